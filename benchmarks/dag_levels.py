@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# (c) 2016 Kim Ebert and contributors
+# Licensed under the MIT license
+"""
+Checks that the dependency graph scheduler builds the same levels as the tree string parser and the repeated
+pull down passes it replaced, which are kept below as the reference. Random diamond graphs, some with terminal
+and exclude_bu2 components, are compared for the build up to levels, the order of dependencies.txt and the tree of
+dependency_tree.txt. The pull down pass is also compared on its own on random level lists. The reference never
+filters the last level, so a component pulled down out of it stays in it as well. That can't happen to the levels
+of a build up to, where the last level is the component being built, but the pass has to keep it all the same.
+"""
+import argparse as ap
+import copy
+import os
+import random
+import sys
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+import synthetic
+from lib.config import Config
+
+
+def reference_get_deps(tree):
+    """
+    ComponentTree.get_deps before the scheduler: the rendered tree is parsed back into levels.
+    """
+    tree = str(tree).replace('\n', '')
+    build_info = {}
+    while tree.find('\t') != -1:
+        level = 0
+        while tree.startswith('\t'):
+            tree = tree[1:]
+            level += 1
+        next_ = tree.find('\t')
+        if level not in build_info:
+            build_info[level] = []
+        build_info[level].append(tree[0:tree.find('(')])
+        tree = tree[next_:]
+    if 0 not in build_info:
+        build_info[0] = [tree[0:tree.find('(')]]
+    sorted_tuples = sorted(build_info.items(), reverse=True)
+    _, dependencies = zip(*sorted_tuples)
+    deps = list(dependencies)
+    already_built_prev = list()
+    for i, _ in enumerate(deps):
+        already_built_curr = set()
+        for d in deps[i]:
+            if d not in already_built_prev:
+                already_built_curr.add(d)
+        deps[i] = list(already_built_curr)
+        already_built_prev.extend(list(already_built_curr))
+    return [d for d in deps if len(d) > 0]
+
+
+def reference_pull_deps_down_one_level(dependencies, components):
+    def depends_on(component, me):
+        return [d for d in Config.get_config_component(components, component)['dependencies']
+                if d['type'] == 'built' and d['component'] == me]
+
+    previously_pulled_down = list()
+    for i, _ in enumerate(dependencies):
+        if len(dependencies) < i + 2:
+            break
+        cant_be_pulled_down = list()
+        for component in dependencies[i]:
+            cant_be_pulled_down.extend([c for c in dependencies[i + 1] if depends_on(c, component)])
+        dependencies[i] = [x for x in dependencies[i] if x not in previously_pulled_down] + \
+            [x for x in dependencies[i + 1] if x not in cant_be_pulled_down]
+        previously_pulled_down = dependencies[i]
+    return dependencies
+
+
+def reference_build_up_to_deps(component_name, components):
+    deps = reference_get_deps(Config.get_built_component_tree(component_name, components))
+    while True:
+        new_deps = reference_pull_deps_down_one_level(copy.deepcopy(deps), components)
+        if not set(map(tuple, deps)).symmetric_difference(set(map(tuple, new_deps))):
+            break
+        deps = new_deps
+    return deps
+
+
+def reference_component_types(component_name, components, build_type, dep_type='code', comp_types=None,
+                              built_descendant=False):
+    if not comp_types:
+        comp_types = {component_name: dep_type}
+    if dep_type == 'built' or built_descendant:
+        dep_type = build_type
+    if component_name not in comp_types or dep_type == 'code':
+        comp_types[component_name] = dep_type
+    if Config.is_terminal_dependency(component_name, dep_type, components):
+        return comp_types
+    for dep in Config.get_config_component(components, component_name)['dependencies']:
+        reference_component_types(dep['component'], components, build_type, dep_type=dep['type'],
+                                  comp_types=comp_types, built_descendant=built_descendant or dep_type == build_type)
+    return comp_types
+
+
+def generate_components(components, fanout, seed):
+    """
+    A random dependency graph where every component depends on up to fanout components after it, so dependencies
+    skip levels and many components are pulled down. Some components are terminal or excluded from build up to.
+    """
+    r = random.Random(seed)
+    generated = []
+    for i in range(components):
+        below = ['c%d' % j for j in range(i + 1, components)]
+        dependencies = [{'component': dep, 'type': r.choice(['built', 'built', 'built', 'code', 'test'])}
+                        for dep in r.sample(below, min(r.randint(0, fanout), len(below)))]
+        attributes = {'exclude_bu2': i > 0 and r.random() < 0.05, 'platforms': [synthetic.BUILD_TYPE]}
+        if i > 0 and r.random() < 0.1:
+            attributes['terminal_dependency'] = True
+        generated.append({'name': 'c%d' % i, 'dependencies': dependencies, 'attributes': attributes})
+    return generated
+
+
+def sorted_levels(levels):
+    return [sorted(level) for level in levels]
+
+
+def check(components, top):
+    """
+    Return the differences between the reference and this tree for top.
+    """
+    errors = []
+    reference = sorted_levels(reference_build_up_to_deps(top, components))
+    levels = sorted_levels(Config.get_dependency_graph(components).build_up_to_levels(top))
+    if levels != reference:
+        errors.append("%s: build up to levels %s instead of %s" % (top, levels, reference))
+
+    for build_type in (synthetic.BUILD_TYPE, 'all'):
+        reference_types = reference_component_types(top, components, build_type)
+        types = Config.get_component_types(top, copy.deepcopy(components), build_type)
+        if types != reference_types:
+            errors.append("%s: component types %s instead of %s" % (top, types, reference_types))
+            continue
+        tree = Config.get_component_tree(top, components, copy.deepcopy(types))
+        reference_order = sorted_levels(reference_get_deps(tree))
+        order = sorted_levels(tree.get_deps())
+        if order != reference_order:
+            errors.append("%s: dependencies.txt levels %s instead of %s" % (top, order, reference_order))
+    return errors
+
+
+def check_pull_down(components, r):
+    """
+    Run one pull down pass of the reference and of the graph on random levels. Returns the differences and whether
+    the last level kept a component that was pulled down out of it.
+    """
+    names = [c['name'] for c in components]
+    r.shuffle(names)
+    cuts = sorted(r.sample(range(1, len(names)), r.randint(1, min(5, len(names) - 1))))
+    levels = [names[i:j] for i, j in zip([0] + cuts, cuts + [len(names)])]
+    reference = reference_pull_deps_down_one_level(copy.deepcopy(levels), components)
+    pulled = Config.get_dependency_graph(components).pull_down_one_level(copy.deepcopy(levels))
+    errors = []
+    if pulled != reference:
+        errors.append("pull down of %s gave %s instead of %s" % (levels, pulled, reference))
+    return errors, bool(set(reference[-1]) & set(reference[-2]))
+
+
+def main(**args_):
+    errors = []
+    unfiltered = 0
+    checked = 0
+    for seed in range(args_['graphs']):
+        components = generate_components(args_['components'], args_['fanout'], seed)
+        tops = [c['name'] for c in components if not c['attributes']['exclude_bu2']][:args_['tops']]
+        for top in tops:
+            errors += ["graph %d, %s" % (seed, e) for e in check(components, top)]
+            checked += 1
+        r = random.Random(seed)
+        for _ in range(args_['tops']):
+            pull_down_errors, kept = check_pull_down(components, r)
+            errors += ["graph %d, %s" % (seed, e) for e in pull_down_errors]
+            unfiltered += kept
+    for error in errors:
+        print(error)
+    print("%d graphs, %d tops, %d pull downs that left a component in the last level: %s" % (
+        args_['graphs'], checked, unfiltered, "%d differences" % len(errors) if errors else "ok"))
+    if not unfiltered:
+        print("No pull down left a component in the last level, use more graphs.")
+    if errors or not unfiltered:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    parser = ap.ArgumentParser(description="Compare the scheduled build levels with the ones of the tree parser.")
+    parser.add_argument('--graphs',
+                        help="""
+                            The number of generated graphs. Defaults to 200
+                             """,
+                        type=int,
+                        default=200)
+    parser.add_argument('--components',
+                        help="""
+                            The number of components of every graph. Defaults to 30
+                             """,
+                        type=int,
+                        default=30)
+    parser.add_argument('--fanout',
+                        help="""
+                            The number of dependencies of every component. Defaults to 3
+                             """,
+                        type=int,
+                        default=3)
+    parser.add_argument('--tops',
+                        help="""
+                            How many components of every graph are built up to. Defaults to 4
+                             """,
+                        type=int,
+                        default=4)
+    args = parser.parse_args()
+    main(**vars(args))
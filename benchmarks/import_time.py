@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# (c) 2016 Kim Ebert and contributors
+# Licensed under the MIT license
+"""
+Checks that the sandman tools start without importing what only their commands need. Every tool is run with
+--help under python -X importtime. It fails when a tool imports one of the modules in HEAVY_MODULES or when its
+own imports take longer than the budget.
+"""
+import argparse as ap
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOOLS = ['sm', 'sb2', 'sandman-repos']
+HEAVY_MODULES = ['jsonschema', 'argcomplete', 'lib.config', 'lib.sandbox', 'vcs.vcsrepo', 'concurrent.futures']
+# Milliseconds a tool may spend importing its own modules, interpreter start up not included
+DEFAULT_BUDGET = 40
+
+
+def import_times(args, cwd):
+    """
+    Return the top level imports of running python with args as a dict of module name to cumulative
+    microseconds, and every module imported.
+    """
+    env = dict(os.environ, SANDMAN_NO_DAEMON='1')
+    env.pop('_ARGCOMPLETE', None)
+    p = subprocess.Popen([sys.executable, '-X', 'importtime'] + args, cwd=cwd, env=env, stdout=subprocess.DEVNULL,
+                         stderr=subprocess.PIPE)
+    err = p.communicate()[1].decode()
+    top_level = {}
+    modules = set()
+    for line in err.split('\n'):
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|')
+        if not cumulative.strip().isdigit():
+            continue
+        modules.add(name.strip())
+        if not name.startswith('  ', 1):
+            top_level[name.strip()] = int(cumulative)
+    return top_level, modules
+
+
+def check(tool, budget, startup, cwd):
+    top_level, modules = import_times([os.path.join(ROOT, tool), '--help'], cwd)
+    own = sum(t for name, t in top_level.items() if name not in startup) / 1000.0
+    heavy = [m for m in HEAVY_MODULES if m in modules]
+    print("%s: %.1fms of imports%s" % (tool, own, ", imports %s" % ", ".join(heavy) if heavy else ""))
+    return own <= budget and not heavy
+
+
+def main(**args_):
+    with tempfile.TemporaryDirectory() as cwd:
+        startup = import_times(['-c', 'pass'], cwd)[1]
+        results = [check(tool, args_['budget'], startup, cwd) for tool in TOOLS]
+    if not all(results):
+        print("Start up imports are over the budget of %sms or load modules they don't need." % args_['budget'])
+        sys.exit(1)
+
+if __name__ == '__main__':
+    parser = ap.ArgumentParser(description="Fail when the sandman tools import too much to start.")
+    parser.add_argument('--budget',
+                        help="""
+                            Milliseconds each tool may spend on its own imports.
+                            Defaults to %s
+                             """ % DEFAULT_BUDGET,
+                        type=float,
+                        default=DEFAULT_BUDGET)
+    args = parser.parse_args()
+    main(**vars(args))
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# (c) 2016 Kim Ebert and contributors
+# Licensed under the MIT license
+"""
+Checks that updating a checkout through the shared mirror does what git pull did: the checked out branch moves to
+its own upstream, a branch without an upstream fails and a mirror that can't be refreshed falls back to the source.
+"""
+import os
+import subprocess
+import sys
+import tempfile
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+import synthetic
+from vcs.git import Git
+from vcs.mirror import MirrorCache
+
+FEATURE = 'myfeature'
+
+
+def git(*args):
+    return subprocess.check_output(['git'] + list(args), env=synthetic.GIT_ENV,
+                                   stderr=subprocess.DEVNULL).decode().strip()
+
+
+def push_commit(work, branch, name):
+    """
+    Commit a new file on branch of the repository work was cloned from.
+    """
+    git('-C', work, 'checkout', '--quiet', '-B', branch, 'origin/%s' % branch)
+    with open(os.path.join(work, name), 'w') as f:
+        f.write(name)
+    git('-C', work, 'add', name)
+    git('-C', work, 'commit', '--quiet', '-m', name)
+    git('-C', work, 'push', '--quiet', 'origin', branch)
+    return git('-C', work, 'rev-parse', 'HEAD')
+
+
+def clone(root, bare, name, branch=None):
+    """
+    Clone bare through a new mirror cache and check out branch, which tracks the branch of the same name.
+    """
+    vcs = Git(os.path.join(root, name), 'file://%s' % bare, synthetic.BRANCH,
+              mirror=MirrorCache(os.path.join(root, 'mirrors')))
+    vcs.init()
+    if branch:
+        git('-C', vcs.path, 'checkout', '--quiet', '-b', branch, '--track', 'origin/%s' % branch)
+    return vcs
+
+
+def updated(vcs):
+    """
+    Update vcs through a new mirror cache, like a new sandman process would. Returns the error of the update.
+    """
+    vcs.mirror = MirrorCache(vcs.mirror.root)
+    try:
+        vcs.update()
+    except subprocess.CalledProcessError as e:
+        return e
+    return None
+
+
+def main():
+    errors = []
+    with tempfile.TemporaryDirectory() as root:
+        bare = os.path.join(root, 'repo.git')
+        synthetic.fast_import(bare, synthetic.BRANCH, {'README': 'repo\n'})
+        git('-C', bare, 'branch', FEATURE, synthetic.BRANCH)
+        work = os.path.join(root, 'work')
+        git('clone', '--quiet', bare, work)
+
+        feature = clone(root, bare, 'feature', FEATURE)
+        default = clone(root, bare, 'default')
+        local = clone(root, bare, 'local')
+        git('-C', local.path, 'checkout', '--quiet', '-b', 'local-only')
+        master_head = push_commit(work, synthetic.BRANCH, 'on-master')
+        feature_head = push_commit(work, FEATURE, 'on-feature')
+
+        error = updated(feature)
+        if error or git('-C', feature.path, 'rev-parse', 'HEAD') != feature_head:
+            errors.append("%s wasn't moved to its upstream: %s" % (FEATURE, error))
+        if git('-C', feature.path, 'rev-parse', '--abbrev-ref', 'HEAD') != FEATURE:
+            errors.append("the checkout left %s" % FEATURE)
+        if os.path.exists(os.path.join(feature.path, 'on-master')):
+            errors.append("%s was merged into %s" % (synthetic.BRANCH, FEATURE))
+        if updated(local) is None:
+            errors.append("a branch without an upstream was updated")
+
+        # A mirror that can't be refreshed is only used for its objects
+        mirror = default.mirror.path_for(default.source)
+        git('-C', mirror, 'remote', 'set-url', 'origin', os.path.join(root, 'missing.git'))
+        error = updated(default)
+        if error or git('-C', default.path, 'rev-parse', 'HEAD') != master_head:
+            errors.append("a stale mirror kept %s from being updated: %s" % (synthetic.BRANCH, error))
+    for error in errors:
+        print(error)
+    print("mirror updates: %s" % ("%d errors" % len(errors) if errors else "ok"))
+    if errors:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
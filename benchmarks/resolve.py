@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# (c) 2016 Kim Ebert and contributors
+# Licensed under the MIT license
+"""
+Times resolving the aspects of the top component of a synthetic config the way gather_facts does for a sandbox.
+The default graph has 500 components in 8 levels with 4 dependencies each, so shared subtrees are reached along
+many paths. With --reference the lib/config.py of another commit resolves the same config too,
+its time is reported next to this tree's and it fails when the two resolve different aspects.
+"""
+import argparse as ap
+import copy
+import importlib.machinery
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, ROOT)
+
+import synthetic
+from lib.config import Config
+
+USERS = {'git': {'name': 'sandman'}}
+SAND_PATH = '/sandboxes/%s.%s.dev' % (synthetic.TOP, synthetic.BRANCH)
+
+
+def load_reference(revision):
+    """
+    Return the Config class of lib/config.py at revision.
+    """
+    source = subprocess.check_output(['git', '-C', ROOT, 'show', '%s:lib/config.py' % revision])
+    with tempfile.NamedTemporaryFile(suffix='.py', delete=False) as f:
+        f.write(source)
+    try:
+        loader = importlib.machinery.SourceFileLoader('reference_config', f.name)
+        spec = importlib.util.spec_from_file_location(loader.name, f.name, loader=loader)
+        if hasattr(importlib.util, 'module_from_spec'):
+            module = importlib.util.module_from_spec(spec)
+            loader.exec_module(module)
+        else:
+            # Python 3.4
+            module = loader.load_module()
+    finally:
+        os.remove(f.name)
+    return module.Config
+
+
+def resolve(config_class, config, repeat):
+    """
+    Return the aspects config_class resolves for the top component and the seconds every run took. Every run gets
+    its own copy of the components so nothing memoized by an earlier run is reused.
+    """
+    dependency_types = config['sandbox_types'][0]['dependency_types']
+    runs = []
+    aspects = None
+    for _ in range(repeat):
+        components = copy.deepcopy(config['components'])
+        start = time.perf_counter()
+        aspects = config_class.get_aspects(synthetic.TOP, components, config['aspects'], dependency_types,
+                                           synthetic.BRANCH, synthetic.BUILD_TYPE, USERS, SAND_PATH)
+        runs.append(time.perf_counter() - start)
+    return dict((k, sorted(json.dumps(a, sort_keys=True) for a in v)) for k, v in aspects.items()), runs
+
+
+def report(name, runs):
+    print("%-24s median %9.4fs  min %9.4fs" % (name, statistics.median(runs), min(runs)))
+
+
+def main(**args_):
+    config = synthetic.generate_config('/repos', args_['components'], args_['fanout'], args_['depth'], args_['seed'])
+    aspects, runs = resolve(Config, config, args_['repeat'])
+    print("%d components, %d resolved for %s" % (args_['components'], len(aspects), synthetic.TOP))
+    report('get_aspects', runs)
+    if not args_['reference']:
+        return
+    reference_aspects, reference_runs = resolve(load_reference(args_['reference']), config, args_['repeat'])
+    report('get_aspects@%s' % args_['reference'], reference_runs)
+    print("%.1fx faster" % (statistics.median(reference_runs) / statistics.median(runs)))
+    if aspects != reference_aspects:
+        print("The aspects differ from the ones resolved by %s" % args_['reference'])
+        sys.exit(1)
+
+if __name__ == '__main__':
+    parser = ap.ArgumentParser(description="Benchmark aspect resolution on a synthetic config.")
+    parser.add_argument('--components',
+                        help="""
+                            The number of components in the generated config. Defaults to 500
+                             """,
+                        type=int,
+                        default=500)
+    parser.add_argument('--fanout',
+                        help="""
+                            The number of dependencies of every component. Defaults to 4
+                             """,
+                        type=int,
+                        default=4)
+    parser.add_argument('--depth',
+                        help="""
+                            The number of dependency levels. Defaults to 8
+                             """,
+                        type=int,
+                        default=8)
+    parser.add_argument('--seed',
+                        help="""
+                            The seed of the generated graph. Defaults to 0
+                             """,
+                        type=int,
+                        default=0)
+    parser.add_argument('--repeat',
+                        help="""
+                            How many times the aspects are resolved. Defaults to 5
+                             """,
+                        type=int,
+                        default=5)
+    parser.add_argument('--reference',
+                        help="""
+                            A commit whose lib/config.py resolves the same config for comparison, eg. the
+                            commit before the resolver was indexed.
+                             """)
+    args = parser.parse_args()
+    main(**vars(args))
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+# (c) 2016 Kim Ebert and contributors
+# Licensed under the MIT license
+"""
+Offline benchmarks of config resolution, the sandbox commands and tool start up on a synthetic workspace of local
+bare repositories. Results are written as json and can be compared with the results of another commit.
+"""
+import argparse as ap
+import contextlib
+import copy
+import io
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, ROOT)
+
+import import_time
+import synthetic
+import lib.config
+from lib.config import Config
+from lib.repositories import Repositories
+from lib.sandbox import Sandbox
+from lib.utils import DEFAULT_JOBS, run_in_parallel
+from vcs.refcache import remote_refs
+from vcs.vcsrepo import VcsRepo
+
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, 'results')
+SANDBOX = '%s.%s.dev' % (synthetic.TOP, synthetic.BRANCH)
+# How many times every code repository is updated, checked and listed by the threaded git run
+STRESS_ROUNDS = 4
+# The benchmarks that need an initialized sandbox
+SANDBOX_BENCHMARKS = ['sandbox.status', 'sandbox.bu2_dependencies', 'git.threaded_stress']
+# Named sizes, the options given on the command line override them
+PRESETS = {
+    'resolve500': {'components': 500, 'fanout': 4, 'depth': 8},
+    'build_info300': {'components': 300, 'branches': 20},
+}
+
+
+class Benchmarks(object):
+    def __init__(self, workdir, components, fanout, depth, seed, repeat, jobs, only=None, branches=20):
+        self.workdir = workdir
+        self.repeat = repeat
+        self.jobs = jobs
+        self.only = only
+        self.results = {}
+        start = time.perf_counter()
+        self.local_config = synthetic.create_workspace(os.path.join(workdir, 'workspace'), components, fanout, depth,
+                                                       seed, branches)
+        print("Created a workspace of %d components on %d branches in %.1fs" % (components, branches,
+                                                                              time.perf_counter() - start))
+        self.config = Config(None, self.local_config)
+        self.sand_path = os.path.join(workdir, 'sandboxes', SANDBOX)
+        self.facts = self.config.gather_facts(synthetic.TOP, synthetic.BRANCH, 'dev', self.sand_path)
+        self.remote = Config.parse_config(self.config.config_path)
+        self.counter = 0
+
+    def time(self, name, func, setup=None, repeat=None):
+        """
+        Time func repeat times. setup runs before every call, outside of the timing, and its result is passed to
+        func.
+        """
+        if not self.selected(name):
+            return
+        runs = []
+        for _ in range(repeat or self.repeat):
+            state = setup() if setup else None
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                func(state)
+                runs.append(time.perf_counter() - start)
+        self.results[name] = {'runs': runs, 'min': min(runs), 'median': statistics.median(runs)}
+        print("%-36s median %9.4fs  min %9.4fs" % (name, self.results[name]['median'], self.results[name]['min']))
+
+    def selected(self, name):
+        return not self.only or any(o in name for o in self.only)
+
+    def new_dir(self):
+        self.counter += 1
+        path = os.path.join(self.workdir, 'run%d' % self.counter)
+        os.makedirs(path)
+        return path
+
+    def cold_validation(self):
+        lib.config._schemas.clear()
+        lib.config._validators.clear()
+        lib.config._validated.clear()
+
+    def run(self, init_repeat):
+        users = self.config.users
+        aspects = self.remote['aspects']
+        dependency_types = self.remote['sandbox_types'][0]['dependency_types']
+        validated = os.path.join(self.workdir, 'validated.json')
+
+        self.time('validate_config.cold', lambda _: Config.validate_config(self.remote, 'remote'),
+                  self.cold_validation)
+        Config.validate_config(self.remote, 'remote', validated)
+        self.time('validate_config.cached', lambda _: Config.validate_config(self.remote, 'remote', validated),
+                  lib.config._validated.clear)
+        self.time('build_info', lambda _: Repositories(self.config, self.jobs).get_build_info())
+        self.time('get_aspects', lambda components: Config.get_aspects(
+            synthetic.TOP, components, aspects, dependency_types, synthetic.BRANCH, synthetic.BUILD_TYPE, users,
+            self.sand_path), lambda: copy.deepcopy(self.remote['components']))
+        self.time('gather_facts', lambda _: self.config.gather_facts(synthetic.TOP, synthetic.BRANCH, 'dev',
+                                                                     self.sand_path))
+        self.time('create_dependency_files', lambda state: Config.create_dependency_files(
+            state[0], synthetic.TOP, state[1], synthetic.BUILD_TYPE),
+            lambda: (self.new_dir(), copy.deepcopy(self.facts['components'])))
+        self.time('get_build_up_to_deps', lambda _: self.config.get_build_up_to_deps(
+            synthetic.TOP, self.facts, jobs=self.jobs), remote_refs.clear)
+        self.time('repository_changesets', lambda _: self.config.get_repository_changesets(
+            'all', {'code': ['code', 'test'], 'built': ['built']}, synthetic.BRANCH, self.jobs),
+            remote_refs.clear)
+
+        sandboxes = []
+        self.time('sandbox.init', lambda base_dir: sandboxes.append(self.sandbox(base_dir).init()) or
+                  sandboxes.append(base_dir), self.new_init, init_repeat)
+        if sandboxes:
+            base_dir = sandboxes[-1]
+        elif not any(self.selected(name) for name in SANDBOX_BENCHMARKS):
+            return
+        else:
+            base_dir = self.new_init()
+            self.sandbox(base_dir).init()
+        self.time('sandbox.status', lambda _: self.sandbox(base_dir).status())
+        self.time('sandbox.bu2_dependencies', lambda _: self.sandbox(base_dir).bu2_dependencies(), remote_refs.clear)
+        self.time('git.threaded_stress', lambda _: self.stress(base_dir), repeat=1)
+
+    def new_init(self):
+        remote_refs.clear()
+        return self.new_dir()
+
+    def sandbox(self, base_dir):
+        return Sandbox(base_dir, SANDBOX, self.config, jobs=self.jobs)
+
+    def stress(self, base_dir):
+        """
+        Update, check and list every code repository of the sandbox from many threads at once. Rounds run one after
+        the other so no two threads work in the same checkout.
+        """
+        def work(aspect):
+            vcsrepo = aspect['vcsrepo']
+            vcs = VcsRepo.get_repo(path=vcsrepo['path'], provider=vcsrepo['provider'], source=vcsrepo['source'],
+                                   revision=vcsrepo['revision'], type_=aspect['type'])
+            vcs.update()
+            vcs.get_status()
+            vcs.branches(fetch=False)
+        aspects = [a for a in self.sandbox(base_dir).facts['aspects'] if a['type'] == 'code']
+        for _ in range(STRESS_ROUNDS):
+            run_in_parallel(work, aspects, max(self.jobs, 8))
+
+    def time_imports(self):
+        if not self.selected('import_time'):
+            return
+        with tempfile.TemporaryDirectory() as cwd:
+            startup = import_time.import_times(['-c', 'pass'], cwd)[1]
+            for tool in import_time.TOOLS:
+                runs = []
+                for _ in range(self.repeat):
+                    top_level = import_time.import_times([os.path.join(ROOT, tool), '--help'], cwd)[0]
+                    runs.append(sum(t for name, t in top_level.items() if name not in startup) / 1000000.0)
+                name = 'import_time.%s' % tool
+                self.results[name] = {'runs': runs, 'min': min(runs), 'median': statistics.median(runs)}
+                print("%-36s median %9.4fs  min %9.4fs" % (name, self.results[name]['median'],
+                                                           self.results[name]['min']))
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', '-C', ROOT, 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(results, previous_path, threshold):
+    """
+    Print the change of every benchmark against the results in previous_path. Returns the benchmarks whose median
+    grew by more than threshold.
+    """
+    with open(previous_path) as f:
+        previous = json.load(f)
+    print("\nCompared with %s (%s):" % (previous_path, previous.get('commit')))
+    regressions = []
+    for name in sorted(results['results']):
+        if name not in previous['results']:
+            continue
+        old = previous['results'][name]['median']
+        new = results['results'][name]['median']
+        ratio = new / old if old else 1.0
+        print("%-36s %9.4fs -> %9.4fs  %+6.1f%%" % (name, old, new, (ratio - 1) * 100))
+        if ratio > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main(**args_):
+    workdir = tempfile.mkdtemp(prefix='sandman-benchmarks-')
+    try:
+        benchmarks = Benchmarks(workdir, args_['components'], args_['fanout'], args_['depth'], args_['seed'],
+                                args_['repeat'], args_['jobs'], args_['only'], args_['branches'])
+        benchmarks.run(args_['init_repeat'])
+        benchmarks.time_imports()
+    finally:
+        if args_['keep']:
+            print("Kept the workspace in %s" % workdir)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    commit = get_commit()
+    results = {
+        'commit': commit,
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': sys.version.split()[0],
+        'parameters': dict((k, args_[k]) for k in ('preset', 'components', 'fanout', 'depth', 'branches', 'seed',
+                                                   'repeat', 'jobs')),
+        'results': benchmarks.results,
+    }
+    output = args_['output'] or os.path.join(RESULTS_DIR, '%s.json' % commit)
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=3, sort_keys=True)
+    print("Results written to %s" % output)
+    if args_['compare']:
+        regressions = compare(results, args_['compare'], args_['threshold'])
+        if regressions:
+            print("Slower by more than %d%%: %s" % ((args_['threshold'] - 1) * 100, ", ".join(regressions)))
+            sys.exit(1)
+
+if __name__ == '__main__':
+    parser = ap.ArgumentParser(description="Benchmark sandman offline on a synthetic workspace.")
+    parser.add_argument('--preset',
+                        help="""
+                            A named size: resolve500 is 500 components with 4 dependencies in 8 levels,
+                            build_info300 is 300 components on 20 config branches.
+                             """,
+                        choices=sorted(PRESETS))
+    parser.add_argument('--components',
+                        help="""
+                            The number of components in the generated config. Defaults to 100
+                             """,
+                        type=int,
+                        default=100)
+    parser.add_argument('--fanout',
+                        help="""
+                            The number of dependencies of every component. Defaults to 3
+                             """,
+                        type=int,
+                        default=3)
+    parser.add_argument('--depth',
+                        help="""
+                            The number of dependency levels. Fewer components per level share more
+                            dependencies. Defaults to 6
+                             """,
+                        type=int,
+                        default=6)
+    parser.add_argument('--branches',
+                        help="""
+                            The number of branches of the config repository, each with its own
+                            generated config. The build info benchmark reads all of them. Defaults to 20
+                             """,
+                        type=int,
+                        default=20)
+    parser.add_argument('--seed',
+                        help="""
+                            The seed of the generated graph. Defaults to 0
+                             """,
+                        type=int,
+                        default=0)
+    parser.add_argument('--repeat',
+                        help="""
+                            How many times every benchmark is run. Defaults to 5
+                             """,
+                        type=int,
+                        default=5)
+    parser.add_argument('--init-repeat',
+                        help="""
+                            How many sandboxes are created by the init benchmark. Defaults to 2
+                             """,
+                        type=int,
+                        default=2)
+    parser.add_argument('--jobs',
+                        help="""
+                            The number of parallel jobs passed to sandman. Defaults to %s
+                             """ % DEFAULT_JOBS,
+                        type=int,
+                        default=DEFAULT_JOBS)
+    parser.add_argument('--only',
+                        help="""
+                            Only run the benchmarks whose name contains one of these strings.
+                             """,
+                        nargs='*')
+    parser.add_argument('--output',
+                        help="""
+                            The json file the results are written to. Defaults to %s/<commit>.json
+                             """ % RESULTS_DIR)
+    parser.add_argument('--compare',
+                        help="""
+                            A results file of an earlier run to compare with. Exits with 1 when a benchmark
+                            got slower than the threshold.
+                             """)
+    parser.add_argument('--threshold',
+                        help="""
+                            The ratio of medians that counts as a regression. Defaults to 1.25
+                             """,
+                        type=float,
+                        default=1.25)
+    parser.add_argument('--keep',
+                        help="""
+                            Keep the generated workspace and sandboxes.
+                             """,
+                        action='store_true')
+    preset = parser.parse_known_args()[0].preset
+    if preset:
+        parser.set_defaults(**PRESETS[preset])
+    args = parser.parse_args()
+    main(**vars(args))
@@ -0,0 +1,118 @@
+"""
+Synthetic sandman workspaces for the benchmarks. A workspace has a remote config with a generated component graph,
+a local bare git repository for the code and built aspect of every component and a local config pointing at them,
+so everything runs offline.
+"""
+import json
+import os
+import random
+import subprocess
+
+BRANCH = 'master'
+BUILD_TYPE = 'linux'
+TOP = 'c0'
+GIT_ENV = dict(os.environ, GIT_AUTHOR_NAME='sandman', GIT_AUTHOR_EMAIL='sandman@localhost',
+               GIT_COMMITTER_NAME='sandman', GIT_COMMITTER_EMAIL='sandman@localhost',
+               GIT_AUTHOR_DATE='1500000000 +0000', GIT_COMMITTER_DATE='1500000000 +0000')
+BUILD_TYPE_SCRIPT = '''def get_build_type():
+    return %r
+''' % BUILD_TYPE
+
+
+def generate_config(repos_dir, components=100, fanout=3, depth=6, seed=0):
+    """
+    Return a remote config with components spread over depth layers. Every component depends on up to fanout
+    components of the next layer, so the small layers of a deep graph are shared by many dependents and the graph
+    is full of diamonds. c0 is the top of the graph.
+    """
+    r = random.Random(seed)
+    layers = [[] for _ in range(depth)]
+    for i in range(components):
+        layers[i * depth // components].append('c%d' % i)
+    graph = []
+    for level, names in enumerate(layers):
+        below = layers[level + 1] if level + 1 < depth else []
+        for name in names:
+            # Code dependencies bring their tests along, like the dependency types of sandman-repos
+            dependencies = [{'component': dep, 'type': r.choice(['built', 'built', 'built', 'code', 'code'])}
+                            for dep in r.sample(below, min(fanout, len(below)))]
+            graph.append({'name': name, 'dependencies': dependencies,
+                          'attributes': {'exclude_bu2': False, 'platforms': [BUILD_TYPE]}})
+    graph.append({'name': 'buildscripts', 'dependencies': [],
+                  'attributes': {'exclude_bu2': True, 'platforms': [BUILD_TYPE]}})
+    # file:// so clones honour --depth like they do from a server
+    code = 'file://' + os.path.join(repos_dir, '${component}.git')
+    built = 'file://' + os.path.join(repos_dir, '${component}.built.git')
+    return {
+        'aspects': [
+            {'name': 'code', 'type': 'code', 'vcsrepo': {'provider': 'git', 'source': code, 'revision': '${branch}'}},
+            {'name': 'test', 'type': 'test', 'vcsrepo': {'provider': 'git', 'source': code, 'revision': '${branch}'}},
+            # Only read by sandman-repos, which resolves code, test and report aspects
+            {'name': 'report', 'type': 'code',
+             'vcsrepo': {'provider': 'git', 'source': code, 'revision': '${branch}'}},
+            {'name': 'built', 'type': 'built',
+             'vcsrepo': {'provider': 'git', 'source': built, 'revision': '${built}'}},
+        ],
+        'commands': [
+            {'name': 'tools', 'type': 'command', 'command': ['true']},
+            {'name': 'init_config', 'type': 'command', 'command': ['true']},
+            {'name': 'status', 'type': 'builtin'},
+        ],
+        'sandbox_types': [
+            {'name': 'dev', 'default': True, 'commands': ['tools', 'init_config', 'status'],
+             'dependency_types': {'code': ['code', 'test'], 'built': ['built']}},
+        ],
+        'components': graph,
+    }
+
+
+def fast_import(path, branch, files):
+    """
+    Create a bare repository at path, or add to an existing one, a root commit holding files on branch. Python
+    scripts are executable.
+    """
+    subprocess.check_call(['git', 'init', '--quiet', '--bare', path], env=GIT_ENV)
+    stream = ['commit refs/heads/%s' % branch, 'committer sandman <sandman@localhost> 1500000000 +0000',
+              'data 4', 'init']
+    for name, content in sorted(files.items()):
+        data = content.encode()
+        stream.append('M %s inline %s' % ('100755' if name.endswith('.py') else '100644', name))
+        stream.append('data %d' % len(data))
+        stream.append(content)
+    p = subprocess.Popen(['git', '-C', path, 'fast-import', '--quiet'], stdin=subprocess.PIPE, env=GIT_ENV)
+    p.communicate(('\n'.join(stream) + '\n').encode())
+    if p.returncode:
+        raise subprocess.CalledProcessError(p.returncode, 'git fast-import')
+
+
+def create_workspace(root, components=100, fanout=3, depth=6, seed=0, branches=1):
+    """
+    Create the repositories and configs of a synthetic workspace in root. Returns the path of the local config.
+    Besides BRANCH the config repository has branches b1, b2, ... up to branches in total, each with a config
+    generated from its own seed.
+    """
+    repos_dir = os.path.join(root, 'repos')
+    os.makedirs(repos_dir)
+    config = generate_config(repos_dir, components, fanout, depth, seed)
+    for component in config['components']:
+        name = component['name']
+        fast_import(os.path.join(repos_dir, '%s.git' % name), BRANCH, {'README': name})
+        fast_import(os.path.join(repos_dir, '%s.built.git' % name), BUILD_TYPE,
+                    {'source.txt': '%s.code: none\n' % name})
+    fast_import(os.path.join(repos_dir, 'config.git'), BRANCH, {
+        'config.json': json.dumps(config, indent=1),
+        'build_type.py': BUILD_TYPE_SCRIPT,
+    })
+    for b in range(1, branches):
+        fast_import(os.path.join(repos_dir, 'config.git'), 'b%d' % b, {
+            'config.json': json.dumps(generate_config(repos_dir, components, fanout, depth, seed + b), indent=1),
+            'build_type.py': BUILD_TYPE_SCRIPT,
+        })
+    local_config = os.path.join(root, 'sand.conf')
+    with open(local_config, 'w') as f:
+        json.dump({
+            'vcsrepo': {'path': os.path.join(root, 'cache', 'config'), 'source': os.path.join(repos_dir, 'config.git'),
+                        'revision': BRANCH, 'provider': 'git'},
+            'user': {'git': {'name': 'sandman'}},
+        }, f)
+    return local_config
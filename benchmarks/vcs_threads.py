@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# (c) 2016 Kim Ebert and contributors
+# Licensed under the MIT license
+"""
+Checks that the VCS backends are safe to use from a thread pool. Every repository gets its own branch, untracked
+files and head, and many threads update, query and list them at once. It fails when an operation returns the answer
+of another repository or when anything changes the working directory of the process.
+"""
+import argparse as ap
+import os
+import subprocess
+import sys
+import tempfile
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+import synthetic
+from lib.utils import run_in_parallel
+from vcs.git import Git
+
+
+def create_repositories(root, count):
+    """
+    Return (name, clone, expected answers) of count clones of their own bare repository.
+    """
+    repositories = []
+    for i in range(count):
+        name = 'r%d' % i
+        bare = os.path.join(root, 'repos', '%s.git' % name)
+        synthetic.fast_import(bare, synthetic.BRANCH, {'README': '%s\n' % name})
+        subprocess.check_call(['git', '-C', bare, 'branch', 'only-%s' % name, synthetic.BRANCH])
+        vcs = Git(os.path.join(root, 'clones', name), 'file://%s' % bare, synthetic.BRANCH)
+        vcs.init()
+        for j in range(i % 4):
+            with open(os.path.join(vcs.path, 'untracked%d' % j), 'w') as f:
+                f.write(name)
+        head = subprocess.check_output(['git', '-C', bare, 'rev-parse', synthetic.BRANCH]).decode().strip()
+        repositories.append((name, vcs, {
+            'head': head,
+            'readme': '%s\n' % name,
+            'branches': sorted([synthetic.BRANCH, 'only-%s' % name]),
+            'untracked': i % 4,
+        }))
+    return repositories
+
+
+def check_repository(repository, cwd):
+    """
+    Run the operations of one round on a repository and return what they got wrong.
+    """
+    name, vcs, expected = repository
+    errors = []
+    vcs.update()
+    status = vcs.get_status()
+    got = {
+        'head': vcs.get_head_revision(),
+        'readme': vcs.show_file('HEAD', 'README'),
+        'branches': sorted(vcs.branches(fetch=False)),
+        'untracked': status['untracked'] if status else 0,
+    }
+    for key in sorted(expected):
+        if got[key] != expected[key]:
+            errors.append("%s: %s was %r instead of %r" % (name, key, got[key], expected[key]))
+    if os.getcwd() != cwd:
+        errors.append("%s: the working directory changed to %s" % (name, os.getcwd()))
+    return errors
+
+
+def main(**args_):
+    chdirs = []
+    chdir = os.chdir
+
+    def recording_chdir(path):
+        chdirs.append(path)
+        chdir(path)
+
+    with tempfile.TemporaryDirectory() as root:
+        repositories = create_repositories(root, args_['repositories'])
+        cwd = os.getcwd()
+        os.chdir = recording_chdir
+        try:
+            errors = []
+            for _ in range(args_['rounds']):
+                results = run_in_parallel(lambda r: check_repository(r, cwd), repositories, args_['jobs'])
+                errors += [e for result in results for e in result]
+        finally:
+            os.chdir = chdir
+    if chdirs:
+        errors.append("os.chdir was called with %s" % ", ".join(sorted(set(chdirs))))
+    for error in errors:
+        print(error)
+    print("%d repositories, %d rounds on %d threads: %s" % (args_['repositories'], args_['rounds'], args_['jobs'],
+                                                           "%d errors" % len(errors) if errors else "ok"))
+    if errors:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    parser = ap.ArgumentParser(description="Fail when VCS operations run from a thread pool interfere.")
+    parser.add_argument('--repositories',
+                        help="""
+                            The number of repositories. Defaults to 24
+                             """,
+                        type=int,
+                        default=24)
+    parser.add_argument('--rounds',
+                        help="""
+                            How many times every repository is checked. Defaults to 5
+                             """,
+                        type=int,
+                        default=5)
+    parser.add_argument('--jobs',
+                        help="""
+                            The number of threads. Defaults to 16
+                             """,
+                        type=int,
+                        default=16)
+    args = parser.parse_args()
+    main(**vars(args))
@@ -17,6 +17,7 @@ mkdir -p $ROOT/etc/profile.d
 cp ../sb2 $SANDMAN_HOME/bin
 cp ../sm $SANDMAN_HOME/bin
 cp ../sandman-repos $SANDMAN_HOME/bin
+cp ../sandmand $SANDMAN_HOME/bin
 cp ../LICENSE $SANDMAN_HOME
 cp ../README.txt $SANDMAN_HOME
 cp ../requirements.txt $SANDMAN_HOME
@@ -32,6 +33,7 @@ cat >$SANDMAN_HOME/etc/config.json <<EOL
 		"revision": "master",
 		"provider": "git"
 	},
+	"mirror_path": "/opt/sandman/cache/mirrors",
 	"user": {
 		"bzr": {"name": "\${system_user}"},
 		"git": {"name": "\${system_user}"}
@@ -1,4 +1,5 @@
 #!/bin/bash
 
-chmod 777 /opt/sandman/cache
+mkdir -p /opt/sandman/cache/mirrors
+chmod 777 /opt/sandman/cache /opt/sandman/cache/mirrors
 echo "Please run command 'source /etc/profile.d/sandman.sh' to add sandman to path"
@@ -1,8 +1,10 @@
 #!/usr/bin/env bash
 
-rm -rf /opt/sandman/cache
-mkdir /opt/sandman/cache
-chmod 777 /opt/sandman/cache
+# Sandboxes borrow objects from the mirrors so they have to survive a reinstall
+mkdir -p /opt/sandman/cache
+find /opt/sandman/cache -mindepth 1 -maxdepth 1 ! -name mirrors -exec rm -rf {} +
+mkdir -p /opt/sandman/cache/mirrors
+chmod 777 /opt/sandman/cache /opt/sandman/cache/mirrors
 easy_install-3.4 pip
 pip3 install argcomplete
 pip3 install jsonschema
@@ -0,0 +1,40 @@
+import json
+import os
+import tempfile
+
+# Read once, os.umask can only be read by setting it, which isn't safe while other threads create files
+_umask = os.umask(0)
+os.umask(_umask)
+
+
+def read_json(path, default=None):
+    """
+    Read a json cache file. Returns default if the file is missing or can't be parsed.
+    """
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def write_json(path, data):
+    """
+    Atomically write a json cache file so concurrent readers never see a partial file. The file keeps the mode
+    of the one it replaces, a new one gets the mode the umask allows.
+    Failing to write a cache is never fatal, so errors are ignored.
+    """
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.%s.' % os.path.basename(path))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        # mkstemp creates the file for the owner only, caches are shared by everyone using the sandman cache
+        try:
+            mode = os.stat(path).st_mode & 0o777
+        except OSError:
+            mode = 0o666 & ~_umask
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
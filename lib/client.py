@@ -0,0 +1,54 @@
+import json
+import os
+import sys
+
+DAEMON_SOCKET = os.path.join(os.path.expanduser('~'), '.sandman', 'sandmand.sock')
+
+
+def get_socket_path():
+    return os.environ.get('SANDMAN_SOCKET', DAEMON_SOCKET)
+
+
+def run_in_daemon(program, argv):
+    """
+    Ask a running sandmand to run program with argv and relay its output. Returns the exit status, or None when
+    there is no daemon or it left the command to be run in process. Only needs the standard library so a command
+    served by the daemon doesn't pay for the imports of the full tool.
+    """
+    if os.environ.get('SANDMAN_NO_DAEMON') or '_ARGCOMPLETE' in os.environ:
+        return None
+    path = get_socket_path()
+    if not os.path.exists(path):
+        return None
+    import socket
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    replied = False
+    try:
+        connection.connect(path)
+        # The command runs with the environment of the caller, eg. to reach remotes through its ssh agent
+        request = {'program': program, 'argv': argv, 'cwd': os.getcwd(), 'env': dict(os.environ)}
+        connection.sendall(json.dumps(request).encode() + b'\n')
+        for line in connection.makefile('rb'):
+            message = json.loads(line.decode())
+            replied = True
+            if 'local' in message:
+                return None
+            if 'exit' in message:
+                return message['exit']
+            stream = sys.stdout if message['stream'] == 'out' else sys.stderr
+            stream.write(message['data'])
+            stream.flush()
+    except (OSError, ValueError):
+        pass
+    finally:
+        connection.close()
+    if not replied:
+        return None
+    sys.stderr.write("The connection to sandmand was lost before %s finished.\n" % program)
+    return 1
+
+
+def exit_if_served(program, argv):
+    status = run_in_daemon(program, argv)
+    if status is not None:
+        sys.exit(status)
@@ -1,64 +1,135 @@
+import importlib.util
 import json
-from jsonschema import validate
 import os
 import re
 from vcs.vcsrepo import VcsRepo
+from vcs.mirror import get_mirror_cache
+from vcs.refcache import remote_refs
 from lib.exceptions import ConfigError
 from lib.exceptions import VcsError
 from lib.exceptions import CommandError
-from jsonschema.exceptions import ValidationError
 from copy import deepcopy
 from subprocess import CalledProcessError
 from datetime import datetime, timezone
 import subprocess
 import getpass
+import hashlib
+import platform
 import shutil
-import copy
+import time
+import threading
+from lib.cache import read_json, write_json
+from lib.utils import run_in_parallel, DEFAULT_JOBS
+from lib.dag import DependencyGraph
+from lib.manifest import write_manifest, MANIFEST_NAME
+from lib import layout
+from lib import trace
 
 config = None
+# Config schemas, their compiled validators and the digests of configs that passed validation, shared by the
+# whole process
+_schemas = {}
+_validators = {}
+_validators_lock = threading.Lock()
+_validated = set()
 REMOTE_CONF_NAME = 'config.json'
 REMOTE_SCRIPT_NAME = 'build_type.py'
-LOCAL_CONF = os.path.join(os.path.expanduser('~'), '.sand.conf')
-DEFAULT_CONF = '/opt/sandman/etc/config.json'
+# Seconds the config repo is trusted before it is fetched again. Can be changed with 'config_ttl' in the local config.
+CONFIG_TTL = 300
+# Built aspects only need their latest revision unless the aspect configures its own fetch
+BUILT_FETCH = {'depth': 1}
+# Bump when the layout of the facts gathered for a sandbox changes so cached facts are resolved again
+FACTS_VERSION = 1
+# How many validated config digests are remembered on disk
+VALIDATED_CACHE_SIZE = 64
+# How many build type scripts have their per host results remembered on disk
+BUILD_TYPE_CACHE_SIZE = 16
 ALL_BUILD_TYPES = ['built.osx_universal', 'built.linux_armv6', 'built.linux_x86-64', 'built.linux_i686',
                    'built.linux_x86-64.org', 'built.win_32', 'built.win_x64']
 
 
 class Config:
-    def __init__(self, local_config, config_path):
+    def __init__(self, local_config, config_path, refresh=False):
         if not local_config:
             if not config_path:
                 config_path = Config.local_config_to_parse()
             local_config = self.parse_config(config_path)
         self.validate_config(local_config, 'local')
         local_config = self.inject_variables_into_local_config(local_config)
+        self.vcsrepo = local_config['vcsrepo']
+        self.local_config_hash = hashlib.sha1(json.dumps(local_config, sort_keys=True).encode()).hexdigest()
+        self.ttl = local_config.get('config_ttl', CONFIG_TTL)
+        self.fast_status = local_config.get('fast_status', False)
+        self.manifest_hash = local_config.get('manifest_hash', False)
+        self.mirrors = None
+        if local_config.get('mirror_path'):
+            self.mirrors = get_mirror_cache(local_config['mirror_path'])
+        self.vcs = VcsRepo.get_repo(path=self.vcsrepo['path'],
+                                    provider=self.vcsrepo['provider'],
+                                    source=self.vcsrepo['source'],
+                                    revision=self.vcsrepo['revision'])
+        self.cache_dir = os.path.join(self.vcsrepo['path'], self.vcs.get_hidden_folder(), 'sandman')
+        self.fetch_stamp = os.path.join(self.cache_dir, 'fetch.json')
+        self.validated_cache = os.path.join(self.cache_dir, 'validated.json')
+        self.build_type_cache = os.path.join(self.cache_dir, 'build_types.json')
+        if refresh or not self.is_fresh():
+            self.refresh()
+        self.config_path = os.path.join(self.vcsrepo['path'], REMOTE_CONF_NAME)
+        self.script_path = os.path.join(self.vcsrepo['path'], REMOTE_SCRIPT_NAME)
+        self.users = local_config['user']
+        self.snapshots = ConfigSnapshots(self.vcs, self.cache_dir)
+
+    def is_fresh(self):
+        """
+        Whether the config repo was fetched from the same source less than ttl seconds ago.
+        """
+        stamp = read_json(self.fetch_stamp)
+        if not stamp or 'branches' not in stamp or stamp.get('source') != self.vcsrepo['source'] or \
+                stamp.get('revision') != self.vcsrepo['revision']:
+            return False
+        age = time.time() - stamp.get('fetched', 0)
+        return 0 <= age < self.ttl
+
+    @trace.traced('Config.refresh')
+    def refresh(self):
+        """
+        Fetch the config repo from its remote and remember when it was done.
+        """
         try:
-            self.vcs = Config.clone_or_update_repo(local_config['vcsrepo'], force=True)
+            self.vcs = Config.clone_or_update_repo(self.vcsrepo, force=True)
         except VcsError:
-            shutil.rmtree(local_config['vcsrepo']['path'])
+            shutil.rmtree(self.vcsrepo['path'])
             os.chdir(os.path.dirname(os.path.abspath(__file__)))
-            self.vcs = Config.clone_or_update_repo(local_config['vcsrepo'], force=True)
-        self.config_path = os.path.join(local_config['vcsrepo']['path'], REMOTE_CONF_NAME)
-        self.script_path = os.path.join(local_config['vcsrepo']['path'], REMOTE_SCRIPT_NAME)
-        self.users = local_config['user']
+            self.vcs = Config.clone_or_update_repo(self.vcsrepo, force=True)
+        write_json(self.fetch_stamp, {
+            'fetched': time.time(),
+            'source': self.vcsrepo['source'],
+            'revision': self.vcsrepo['revision'],
+            'branches': self.vcs.branch_revisions(),
+        })
 
     @staticmethod
     def local_config_to_parse():
-        config_path = LOCAL_CONF
-        if not os.path.exists(config_path):
-            config_path = DEFAULT_CONF
-        return config_path
+        return layout.local_config_to_parse()
 
     @staticmethod
-    def clone_or_update_repo(vcsrepo, force=False, type_='code'):
+    def clone_or_update_repo(vcsrepo, force=False, type_='code', mirror=None, fetch=None, reclone=False):
+        """
+        Clone the repository or update its checkout. With reclone a checkout that was left incomplete by an
+        interrupted or failed clone is cloned again, otherwise updating it fails.
+        """
+        if fetch is None:
+            fetch = BUILT_FETCH if type_ == 'built' else {}
         vcs = VcsRepo.get_repo(path=vcsrepo['path'],
                                provider=vcsrepo['provider'],
                                source=vcsrepo['source'],
                                revision=vcsrepo['revision'],
-                               type_=type_)
+                               type_=type_,
+                               mirror=mirror,
+                               fetch=fetch)
         # Init the git repo
         try:
-            if not vcs.exists():
+            if not vcs.exists() or reclone and not vcs.is_complete():
                 if os.path.isdir(vcsrepo['path']):
                     shutil.rmtree(vcsrepo['path'])
                 vcs.init()
@@ -72,93 +143,228 @@ class Config:
 
         return vcs
 
-    @staticmethod
-    def clone_or_update_aspect(aspect, force=False):
-        return Config.clone_or_update_repo(aspect['vcsrepo'], force=force, type_=aspect['type'])
-
+    def clone_or_update_aspect(self, aspect, force=False, reclone=False):
+        return Config.clone_or_update_repo(aspect['vcsrepo'], force=force, type_=aspect['type'], mirror=self.mirrors,
+                                           fetch=aspect.get('fetch'), reclone=reclone)
+
+    def facts_key(self, component, branch, sand_type, sand_path):
+        """
+        Everything the facts of a sandbox are resolved from. The build type is covered by the config commit,
+        which holds build_type.py, and the host it runs on. Returns None when the config commit isn't known.
+        """
+        stamp = read_json(self.fetch_stamp) or {}
+        config_commit = stamp.get('branches', {}).get(branch)
+        if not config_commit:
+            return None
+        return {
+            'version': FACTS_VERSION,
+            'config_commit': config_commit,
+            'component': component,
+            'branch': branch,
+            'sandbox_type': sand_type,
+            'sand_path': sand_path,
+            'local_config': self.local_config_hash,
+            'host': Config.host_id(),
+        }
+
+    @trace.traced('Config.get_build_type')
     def get_build_type(self):
+        """
+        Return the build type of this host according to the build_type.py of the checked out config branch.
+        Scripts that define get_build_type() are loaded in process, older scripts are run with python and their
+        output is used. Results are memoized per script and host.
+        """
         if not os.path.isfile(self.script_path) or not os.access(self.script_path, os.X_OK):
-            raise CommandError("Script %s either doesn't exist or is not executable.")
-        p = subprocess.Popen(["python", self.script_path], stdout=subprocess.PIPE)
-        return p.communicate()[0].decode().replace("\n", "")
+            raise CommandError("Script %s either doesn't exist or is not executable." % self.script_path)
+        with open(self.script_path, 'r') as script_file:
+            source = script_file.read()
+        script_digest = hashlib.sha1(source.encode()).hexdigest()
+        host = "/".join(Config.host_id())
+        memo = read_json(self.build_type_cache, {})
+        if host in memo.get(script_digest, {}):
+            return memo[script_digest][host]
+
+        if Config.is_build_type_plugin(source):
+            build_type = Config.run_build_type_plugin(self.script_path)
+        else:
+            p = subprocess.Popen(["python", self.script_path], stdout=subprocess.PIPE)
+            build_type = p.communicate()[0].decode().replace("\n", "")
+
+        if len(memo) >= BUILD_TYPE_CACHE_SIZE and script_digest not in memo:
+            memo = {}
+        memo.setdefault(script_digest, {})[host] = build_type
+        write_json(self.build_type_cache, memo)
+        return build_type
 
-    def get_build_info(self, build_type, dep_types):
+    @staticmethod
+    def is_build_type_plugin(source):
+        """
+        Whether a build type script defines get_build_type() at module level. The script isn't executed to find out
+        because older scripts print the build type as soon as they are loaded.
+        """
+        import ast
+        try:
+            tree = ast.parse(source)
+        except SyntaxError:
+            return False
+        return any(isinstance(node, ast.FunctionDef) and node.name == 'get_build_type' for node in tree.body)
+
+    @staticmethod
+    def run_build_type_plugin(script_path):
+        spec = importlib.util.spec_from_file_location('sandman_build_type', script_path)
+        try:
+            if hasattr(importlib.util, 'module_from_spec'):
+                module = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(module)
+            else:
+                # Python 3.4
+                module = spec.loader.load_module()
+            build_type = module.get_build_type()
+        except Exception as e:
+            raise CommandError("Script %s failed to return a build type: %s" % (script_path, e))
+        if not isinstance(build_type, str):
+            raise CommandError("Script %s returned %r instead of a build type." % (script_path, build_type))
+        return build_type.strip()
+
+    @staticmethod
+    def host_id():
+        return [platform.system(), platform.node(), platform.release(), platform.machine()]
+
+    def get_build_info(self, build_type, dep_types, jobs=DEFAULT_JOBS):
         urls = {}
         components = {}
-        for branch in self.vcs.branches():
-            try:
-                self.vcs.checkout(branch)
-                self.vcs.update()
-                components[branch] = {}
-                vcs_config = Config.validate_config(Config.parse_config(self.config_path), 'remote')
-                for component in vcs_config['components']:
-                    if 'integrate' in component['attributes'] and not component['attributes']['integrate']:
-                        continue
-                    if 'platforms' not in component['attributes'] or len(component['attributes']['platforms']) == 0:
-                        continue
-                    component_aspects = Config.get_aspects(component['name'], vcs_config['components'], vcs_config['aspects'],
-                                                           dep_types, branch, build_type, self.users,
-                                                           "")
-                    components[branch][component['name']] = component['attributes']
-                    for _, aspects in component_aspects.items():
-                        for a in aspects:
-                            if a['type'] != 'code':
-                                continue
-                            source = re.sub(r'.*/reporoot', '/reporoot', a['vcsrepo']['source'])
-                            source = re.sub(r'.*/gitroot', '/gitroot', source)
-                            if source == "git@gitlab.imat.io:ui/imat.git":
-                                source = "/var/opt/gitlab/git-data/repositories/ui/imat.git"
-                            if a['vcsrepo']['provider'] == 'git':
-                                source = "%s.%s" % (source, a['vcsrepo']['revision'])
-                            if source not in urls.keys():
-                                urls[source] = set()
-                            urls[source].add("%s.%s" % (a['name'], branch))
-            except CalledProcessError as e:
-                raise VcsError(e, self.vcs.path, self.vcs.source, self.vcs.revision)
+        for branch, snapshot in self.snapshots.get_branches(jobs).items():
+            components[branch] = {}
+            vcs_config = snapshot['config']
+            for component in vcs_config['components']:
+                if 'integrate' in component['attributes'] and not component['attributes']['integrate']:
+                    continue
+                if 'platforms' not in component['attributes'] or len(component['attributes']['platforms']) == 0:
+                    continue
+                component_aspects = Config.get_aspects(component['name'], vcs_config['components'], vcs_config['aspects'],
+                                                       dep_types, branch, build_type, self.users,
+                                                       "")
+                components[branch][component['name']] = component['attributes']
+                for _, aspects in component_aspects.items():
+                    for a in aspects:
+                        if a['type'] != 'code':
+                            continue
+                        source = re.sub(r'.*/reporoot', '/reporoot', a['vcsrepo']['source'])
+                        source = re.sub(r'.*/gitroot', '/gitroot', source)
+                        if source == "git@gitlab.imat.io:ui/imat.git":
+                            source = "/var/opt/gitlab/git-data/repositories/ui/imat.git"
+                        if a['vcsrepo']['provider'] == 'git':
+                            source = "%s.%s" % (source, a['vcsrepo']['revision'])
+                        if source not in urls.keys():
+                            urls[source] = set()
+                        urls[source].add("%s.%s" % (a['name'], branch))
         return {'components': components, 'urls': urls}
 
-    def get_repository_changesets(self, build_type, dep_types, b='all'):
+    def get_changeset_candidates(self, build_type, dep_types, b='all', jobs=DEFAULT_JOBS):
+        """
+        Return one aspect per (branch, component, type) of the requested branch and the 'all' branch, each with
+        its branch set.
+        """
         repository_check = {}
+        candidates = []
+        # The 'all' branch is always scanned along with the requested one.
+        branches = ['all', b]
+        for branch, snapshot in self.snapshots.get_branches(jobs, branches).items():
+            vcs_config = snapshot['config']
+            for top in vcs_config['components']:
+                component_aspects = Config.get_aspects(top['name'], vcs_config['components'], vcs_config['aspects'],
+                                                       dep_types, branch, build_type, self.users,
+                                                       "")
+                for _, c_aspects in component_aspects.items():
+                    for a in c_aspects:
+                        if branch not in repository_check.keys():
+                            repository_check[branch] = {}
+                        if a['name'] not in repository_check[branch].keys():
+                            repository_check[branch][a['name']] = {}
+                        if a['type'] not in repository_check[branch][a['name']].keys():
+                            repository_check[branch][a['name']][a['type']] = {}
+                            a['branch'] = branch
+                            candidates.append(a)
+        return candidates
+
+    def get_repository_changesets(self, build_type, dep_types, b='all', jobs=DEFAULT_JOBS, candidates=None,
+                                  unreachable=None):
+        """
+        Return the aspects whose remote has the revision, with the commit it is on. The keys of the aspects whose
+        remote couldn't be listed are added to unreachable when it is given.
+        """
         repositories = []
-        for branch in self.vcs.branches():
-            if branch != 'all' and branch != b:
+        if candidates is None:
+            candidates = self.get_changeset_candidates(build_type, dep_types, b, jobs)
+        candidates = [(a, VcsRepo.get_repo(path=a['vcsrepo']['path'],
+                                           provider=a['vcsrepo']['provider'],
+                                           source=a['vcsrepo']['source'],
+                                           revision=a['vcsrepo']['revision'],
+                                           type_=a['type']
+                                           )) for a in candidates]
+        Config.prefetch_remote_heads([vcs for _, vcs in candidates], jobs)
+        for a, vcs in candidates:
+            if remote_refs.has_failed(vcs.source):
+                if unreachable is not None:
+                    unreachable.append(Config.changeset_key(a))
                 continue
-            try:
-                self.vcs.checkout(branch)
-                self.vcs.update()
-                vcs_config = Config.validate_config(Config.parse_config(self.config_path), 'remote')
-                for top in vcs_config['components']:
-                    component_aspects = Config.get_aspects(top['name'], vcs_config['components'], vcs_config['aspects'],
-                                                           dep_types, branch, build_type, self.users,
-                                                           "")
-                    for _, c_aspects in component_aspects.items():
-                        for a in c_aspects:
-                            vcs = VcsRepo.get_repo(path=a['vcsrepo']['path'],
-                                                   provider=a['vcsrepo']['provider'],
-                                                   source=a['vcsrepo']['source'],
-                                                   revision=a['vcsrepo']['revision'],
-                                                   type_=a['type']
-                                                   )
-
-                            if branch not in repository_check.keys():
-                                repository_check[branch] = {}
-                            if a['name'] not in repository_check[branch].keys():
-                                repository_check[branch][a['name']] = {}
-                            if a['type'] not in repository_check[branch][a['name']].keys():
-                                repository_check[branch][a['name']][a['type']] = {}
-                                a['vcsrepo']['changeset'] = vcs.get_remote_head_revision()
-                                if a['vcsrepo']['changeset']:
-                                    a['branch'] = branch
-                                    del a['vcsrepo']['built_path']
-                                    del a['vcsrepo']['path']
-                                    repositories.append(a)
-            except CalledProcessError as e:
-                raise VcsError(e, self.vcs.path, self.vcs.source, self.vcs.revision)
-        return sorted(repositories, key=lambda x: (x['branch'], x['name'], x['type']))
+            a['vcsrepo']['changeset'] = vcs.get_remote_head_revision()
+            if a['vcsrepo']['changeset']:
+                del a['vcsrepo']['built_path']
+                del a['vcsrepo']['path']
+                repositories.append(a)
+        return sorted(repositories, key=Config.changeset_key)
+
+    def get_changeset_changes(self, build_type, dep_types, state_path, b='all', jobs=DEFAULT_JOBS):
+        """
+        Return the changesets that are new, changed or removed since the last call with the same state file.
+        While the config branches stay on the same commits the aspects to look up are taken from the state file
+        instead of walking the config again, so a poll costs one ref listing per remote. The changesets of a remote
+        that can't be listed are kept as they were instead of being reported as removed.
+        """
+        state = read_json(state_path, {})
+        revisions = dict((branch, commit) for branch, commit in self.vcs.branch_revisions().items()
+                         if branch in ('all', b))
+        key = hashlib.sha1(json.dumps([revisions, build_type, dep_types, b, self.local_config_hash],
+                                      sort_keys=True).encode()).hexdigest()
+        candidates = state.get('candidates') if state.get('key') == key else None
+        if candidates is None:
+            candidates = self.get_changeset_candidates(build_type, dep_types, b, jobs)
+        unreachable = []
+        repositories = self.get_repository_changesets(build_type, dep_types, b, jobs,
+                                                      [Config.copy_aspect(a) for a in candidates], unreachable)
+        unreachable = set(unreachable)
+        repositories = sorted(repositories + [r for r in state.get('changesets', [])
+                                              if Config.changeset_key(r) in unreachable], key=Config.changeset_key)
+        previous = dict((Config.changeset_key(r), r) for r in state.get('changesets', []))
+        current = set(Config.changeset_key(r) for r in repositories)
+        write_json(state_path, {'key': key, 'candidates': candidates, 'changesets': repositories})
+        return {
+            'new': [r for r in repositories if Config.changeset_key(r) not in previous],
+            'changed': [r for r in repositories if Config.changeset_key(r) in previous and
+                        previous[Config.changeset_key(r)] != r],
+            'removed': [r for r in state.get('changesets', []) if Config.changeset_key(r) not in current],
+        }
 
+    @staticmethod
+    def changeset_key(repository):
+        return repository['branch'], repository['name'], repository['type']
+
+    @staticmethod
+    def prefetch_remote_heads(repos, jobs=DEFAULT_JOBS):
+        """
+        List every distinct remote once, in parallel, so the head lookups that follow are served from the
+        remote ref cache.
+        """
+        remotes = {}
+        for vcs in repos:
+            remotes.setdefault(vcs.source, vcs)
+        run_in_parallel(lambda vcs: vcs.get_remote_head_revision(), list(remotes.values()), jobs)
+
+    @trace.traced('Config.gather_facts')
     def gather_facts(self, component, branch, sand_type, sand_path):
         # TODO: fix this try catch around everything crazyness
-        supported_branches = self.vcs.branches()
+        supported_branches = self.vcs.branches(fetch=False)
         if branch not in supported_branches:
             if len(supported_branches) == 0:
                 raise VcsError(
@@ -167,12 +373,13 @@ class Config:
             raise ConfigError("Branch %s is not supported. Available branches: %s" % (branch, supported_branches))
 
         try:
-            self.vcs.checkout(branch)
+            self.vcs.checkout(branch, fetch=False)
+            config_commit = self.vcs.get_head_revision()
         except CalledProcessError as e:
             raise VcsError(e, self.vcs.path, self.vcs.source, self.vcs.revision)
         try:
             build_type = self.get_build_type()
-            vcs_config = Config.validate_config(Config.parse_config(self.config_path), 'remote')
+            vcs_config = Config.validate_config(Config.parse_config(self.config_path), 'remote', self.validated_cache)
             top = Config.get_config_component(vcs_config['components'], component)
             sandbox = Config.get_config_sandbox(vcs_config, sand_type)
             facts = {
@@ -183,6 +390,7 @@ class Config:
                 'config_aspects':  vcs_config['aspects'],
                 'commands': [],
                 'components': vcs_config['components'],
+                'config_commit': config_commit,
                 'env': {},
                 'top': top,
                 'sandbox': sandbox,
@@ -236,10 +444,10 @@ class Config:
                     return aspect
 
     @staticmethod
-    def get_config(configuration=None, config_path=None):
+    def get_config(configuration=None, config_path=None, refresh=False):
         global config
         if config is None:
-            config = Config(configuration, config_path)
+            config = Config(configuration, config_path, refresh)
         return config
 
     @staticmethod
@@ -275,7 +483,7 @@ class Config:
 
     @staticmethod
     def get_config_command(vcs_config, command_name, top_name=None):
-        matched_commands = [c for c in vcs_config['commands'] if command_name == c['name']]
+        matched_commands = ConfigIndex.of(vcs_config['commands']).get(command_name)
         if len(matched_commands) < 1:
             if top_name:
                 raise ConfigError(
@@ -296,10 +504,8 @@ class Config:
 
     @staticmethod
     def get_config_component(components, component_name):
-        c_list = [c for c in components if c['name'] == component_name]
+        c_list = ConfigIndex.of(components).get(component_name)
         if len(c_list) < 1:
-            comp_names = list(set([c['name'] for c in components]))
-            comp_names.sort()
             raise ConfigError(
                 "Component '%s' was not found." % component_name)
         if len(c_list) > 1:
@@ -402,11 +608,24 @@ class Config:
             Config.get_built_component_tree(dep['component'], components, tree.get_child(dep['component']))
         return tree
 
+    @staticmethod
+    def get_dependency_graph(components):
+        memo = ConfigIndex.of(components).memo
+        if 'graph' not in memo:
+            memo['graph'] = DependencyGraph(components)
+        return memo['graph']
+
     @staticmethod
     def get_component_types(component_name, components, build_type, dep_type='code', comp_types=None,
-                            built_descendant=False):
+                            built_descendant=False, visited=None):
         if not comp_types:
             comp_types = {component_name: dep_type}
+        if visited is None:
+            visited = set()
+        # Visiting the same component with the same type again can't change anything.
+        if (component_name, dep_type, built_descendant) in visited:
+            return comp_types
+        visited.add((component_name, dep_type, built_descendant))
 
         if dep_type == 'built' or built_descendant:
             dep_type = build_type
@@ -420,13 +639,14 @@ class Config:
         for dep in Config.get_config_component(components, component_name)['dependencies']:
             if built_descendant or dep_type == build_type:
                 Config.get_component_types(dep['component'], components, build_type, dep_type=dep['type'],
-                                           comp_types=comp_types, built_descendant=True)
+                                           comp_types=comp_types, built_descendant=True, visited=visited)
             else:
                 Config.get_component_types(dep['component'], components, build_type, dep_type=dep['type'],
-                                           comp_types=comp_types, built_descendant=False)
+                                           comp_types=comp_types, built_descendant=False, visited=visited)
         return comp_types
 
     @staticmethod
+    @trace.traced('Config.create_dependency_files')
     def create_dependency_files(sand_path, component_name, components, build_type):
         legacy_file = os.path.join(sand_path, 'dependencies.txt')
         graph_file = os.path.join(sand_path, 'dependency_tree.txt')
@@ -445,18 +665,17 @@ class Config:
             with open(graph_file, 'w') as f:
                 f.write("%s" % comp_tree)
 
-    def get_build_up_to_deps(self, component_name, facts, debug=False):
-        comp_tree = Config.get_built_component_tree(component_name, facts['components'])
+    def get_build_up_to_deps(self, component_name, facts, debug=False, jobs=DEFAULT_JOBS):
         if debug:
             print("----------------------------")
             print("Full Dependency tree for %s:" % component_name)
-            print(comp_tree)
-        deps = comp_tree.get_build_up_to_deps(facts['components'])
+            print(Config.get_built_component_tree(component_name, facts['components']))
+        deps = Config.get_dependency_graph(facts['components']).build_up_to_levels(component_name)
         if debug:
             print("----------------------------")
             print("Build upto dependencies tree for %s:" % component_name)
             print(json.dumps({'bu2_deps': deps}, indent=3))
-        return self.remove_already_published_dependencies(deps, facts, debug)
+        return self.remove_already_published_dependencies(deps, facts, debug, jobs)
 
     @staticmethod
     def combine_build_up_to_deps(list1, list2):
@@ -470,9 +689,61 @@ class Config:
             big_list[i] = list(set(big_list[i] + deps))
         return big_list
 
-    def remove_already_published_dependencies(self, deps, facts, debug):
-        needs_to_be_built = list()
+    def get_published_aspect_vcs(self, component, dep_type, facts):
+        component_aspects = Config.get_aspects(component, facts['components'], facts['config_aspects'],
+                                               {}, facts['branch'], facts['build_type'],
+                                               self.users, facts['sand_path'], recurse=False, dep_type=dep_type)
+        aspect = Config.get_specific_aspect_by_type(component_aspects, dep_type)
+        return VcsRepo.get_repo(path=aspect['vcsrepo']['path'],
+                                provider=aspect['vcsrepo']['provider'],
+                                source=aspect['vcsrepo']['source'],
+                                revision=aspect['vcsrepo']['revision'],
+                                type_=aspect['type'])
+
+    def fetch_published_sources(self, components, facts, heads, jobs=DEFAULT_JOBS):
+        """
+        Fetch the source.txt of every built component and the remote head of every aspect listed in them that isn't
+        in heads yet, all in parallel. Returns the sources by component and adds the heads by (component, type) to
+        heads. A component whose sources can't be fetched gets the exception instead of its sources, so it is only
+        raised if the sources are looked at.
+        """
+        def get_sources(component):
+            try:
+                return self.get_published_aspect_vcs(component, 'built', facts).get_sources()
+            except Exception as e:
+                return e
+        sources = dict(zip(components, run_in_parallel(get_sources, components, jobs)))
+
+        repos = {}
+        for component_sources in sources.values():
+            if isinstance(component_sources, Exception):
+                continue
+            for source in component_sources:
+                key = (source['name'], source['type'])
+                if key in repos or key in heads:
+                    continue
+                try:
+                    repos[key] = self.get_published_aspect_vcs(source['name'], source['type'], facts)
+                except Exception:
+                    # Left for the decision phase, which raises it only if the source is actually looked at.
+                    continue
+        Config.prefetch_remote_heads(repos.values(), jobs)
+        for key, vcs in repos.items():
+            heads[key] = vcs.get_remote_head_revision()
+        return sources
+
+    def remove_already_published_dependencies(self, deps, facts, debug, jobs=DEFAULT_JOBS):
+        graph = Config.get_dependency_graph(facts['components'])
+        heads = {}
+        needs_to_be_built = set()
         for i, _ in enumerate(deps):
+            # Components already scheduled aren't looked at, so a level's sources are fetched once the levels below
+            # it decided what gets built.
+            unscheduled = []
+            for component in deps[i]:
+                if component not in needs_to_be_built and component not in unscheduled:
+                    unscheduled.append(component)
+            published_sources = self.fetch_published_sources(unscheduled, facts, heads, jobs)
             already_built_curr = set()
             for component in deps[i]:
                 if component in needs_to_be_built:
@@ -480,32 +751,20 @@ class Config:
                         print("Scheduling component %s because it depends on something being built for this bu2." % component)
                     already_built_curr.add(component)
                     continue
-                component_aspects = Config.get_aspects(component, facts['components'], facts['config_aspects'],
-                                                       {}, facts['branch'], facts['build_type'],
-                                                       self.users, facts['sand_path'], recurse=False, dep_type='built')
-                built_aspect = Config.get_specific_aspect_by_type(component_aspects, 'built')
-                built_vcs = VcsRepo.get_repo(path=built_aspect['vcsrepo']['path'],
-                                             provider=built_aspect['vcsrepo']['provider'],
-                                             source=built_aspect['vcsrepo']['source'],
-                                             revision=built_aspect['vcsrepo']['revision'],
-                                             type_=built_aspect['type'])
-                sources = built_vcs.get_sources()
+                sources = published_sources[component]
+                if isinstance(sources, Exception):
+                    raise sources
                 if debug:
                     print("----------------------------")
                     print("Looking at sources.txt for %s:" % component)
                 for source in sources:
                     if debug:
                         print(source)
-                    component_aspects = Config.get_aspects(source['name'], facts['components'], facts['config_aspects'],
-                                                           {}, facts['branch'], facts['build_type'],
-                                                           self.users, facts['sand_path'], recurse=False, dep_type=source['type'])
-                    aspect = Config.get_specific_aspect_by_type(component_aspects, source['type'])
-                    vcs = VcsRepo.get_repo(path=aspect['vcsrepo']['path'],
-                                                provider=aspect['vcsrepo']['provider'],
-                                                source=aspect['vcsrepo']['source'],
-                                                revision=aspect['vcsrepo']['revision'],
-                                                type_=aspect['type'])
-                    rev = vcs.get_remote_head_revision()
+                    key = (source['name'], source['type'])
+                    if key not in heads:
+                        vcs = self.get_published_aspect_vcs(source['name'], source['type'], facts)
+                        heads[key] = vcs.get_remote_head_revision()
+                    rev = heads[key]
                     if debug:
                         print("Actual revision is %s" % rev)
                     if not rev or len(rev) < 8 or rev[-8:] not in source['revision']:
@@ -520,39 +779,28 @@ class Config:
                         while len(deps) > level + 2:
                             curr_deps = []
                             for c in prev_deps:
-                                curr_deps.extend(ComponentTree.filter_dependencies_that_depend_on_component(c, facts['components'], deps[level + 1]))
+                                curr_deps.extend([d for d in deps[level + 1] if graph.depends_on(d, c)])
                             parent_components.extend(curr_deps)
                             prev_deps = curr_deps
                             level += 1
                         # Always add the top level
                         parent_components.extend(deps[len(deps) - 1])
-                        needs_to_be_built.extend(parent_components)
+                        needs_to_be_built.update(parent_components)
                         # If even one of the sources is not the same this needs rebuild so breaking out of sources loop
                         break
-            deps[i] = list(already_built_curr)
-            needs_to_be_built.extend(list(already_built_curr))
+            deps[i] = [c for c in deps[i] if c in already_built_curr]
+            needs_to_be_built.update(already_built_curr)
         return [d for d in deps if len(d) > 0]
 
-    @staticmethod
-    def get_manifest_lines(relative_path, folder_to_publish, vcs_hidden_folder):
-        files = []
-        for f in os.listdir(os.path.join(folder_to_publish, relative_path)):
-            if "%s" % vcs_hidden_folder in f:
-                continue
-            path = (os.path.join(folder_to_publish, relative_path, f))
-            if os.path.isdir(path):
-                files += Config.get_manifest_lines(os.path.join(relative_path, f), folder_to_publish, vcs_hidden_folder)
-            else:
-                files.append('%s,%s' % (os.path.join(relative_path, f), os.stat(path).st_size))
-        return files
-
-    def create_publish_files(self, top_name, built_path, aspects, build_type, vcs_hidden_folder):
+    def create_publish_files(self, top_name, built_path, aspects, build_type, vcs_hidden_folder, jobs=DEFAULT_JOBS,
+                             config_commit=None):
         source_file = os.path.join(built_path, 'source.txt')
-        manifest_file = os.path.join(built_path, 'manifest.txt')
-        manifest_lines = Config.get_manifest_lines('', built_path, vcs_hidden_folder)
-        with open(manifest_file, 'w') as f:
-            f.write('Last published on %s\n' % datetime.now(timezone.utc).astimezone().isoformat().replace('T', ' '))
-            f.write('\n'.join(manifest_lines))
+        manifest_file = os.path.join(built_path, MANIFEST_NAME)
+        cache_path = os.path.join(self.cache_dir, 'manifests',
+                                  '%s.json' % hashlib.sha1(os.path.abspath(built_path).encode()).hexdigest())
+        write_manifest(manifest_file, built_path, vcs_hidden_folder,
+                       'Last published on %s' % datetime.now(timezone.utc).astimezone().isoformat().replace('T', ' '),
+                       self.manifest_hash, cache_path, jobs)
         top_revision = None
         with open(source_file, 'w') as f:
             for a in sorted(aspects, key=lambda x: (x['name'], x['type'])):
@@ -570,7 +818,18 @@ class Config:
                 else:
                     type_ = a['type']
                 f.write("%s.%s: %s\n" % (a['name'], type_, rev))
-        shutil.copy(self.config_path, built_path)
+        config_text = None
+        if config_commit:
+            try:
+                config_text = self.vcs.show_file(config_commit, REMOTE_CONF_NAME)
+            except NotImplementedError:
+                pass
+        if config_text is None:
+            shutil.copy(self.config_path, built_path)
+        else:
+            # The checkout of the config repo can be on another branch when the facts came from the cache
+            with open(os.path.join(built_path, REMOTE_CONF_NAME), 'w') as f:
+                f.write(config_text)
         return top_revision
 
     @staticmethod
@@ -584,10 +843,18 @@ class Config:
             return False
 
     @staticmethod
+    @trace.traced('Config.get_aspects')
     def get_aspects(component_name, components, conf_aspects, dependency_types, branch, arch, users, sand_path,
-                    dep_type='code', comp_aspects=None, recurse=True, built_descendant=False):
+                    dep_type='code', comp_aspects=None, recurse=True, built_descendant=False, visited=None):
         if not comp_aspects:
             comp_aspects = {}
+        if visited is None:
+            visited = set()
+        # A component reached again with the same dependency type adds nothing new, so shared subtrees of
+        # diamond shaped graphs are only walked once.
+        if (component_name, dep_type, built_descendant) in visited:
+            return comp_aspects
+        visited.add((component_name, dep_type, built_descendant))
         if not dependency_types:
             dependency_types = {
                 "code": [
@@ -605,16 +872,8 @@ class Config:
 
         component = Config.get_config_component(components, component_name)
         # Get aspects for the component
-        aspects = []
-        for aspect_name in dependency_types[dep_type]:
-            used_aspects = conf_aspects
-
-            if 'aspects' in component and len(component['aspects']) > 0:
-                for aspect in component['aspects']:
-                    used_aspects = [a for a in used_aspects if a['name'] != aspect['name']]
-                    used_aspects.append(aspect)
-            aspects.append(Config.get_config_aspect(used_aspects, aspect_name, component_name, dep_type=dep_type))
-        aspects = Config.inject_variables_into_aspects(aspects, component_name, branch, arch, users, sand_path)
+        aspects = Config.resolve_aspects(component, components, conf_aspects, dependency_types[dep_type], dep_type,
+                                         branch, arch, users, sand_path)
         if component_name in comp_aspects:
             comp_aspects[component_name].extend(aspects)
         else:
@@ -624,15 +883,46 @@ class Config:
         if recurse and not Config.is_terminal_dependency(component_name, dep_type, components):
             for dep in component['dependencies']:
                 if built_descendant or dep_type == 'built':
-                    comp_aspects.update(
-                        Config.get_aspects(dep['component'], components, conf_aspects, dependency_types, branch, arch,
-                                           users, sand_path, 'built', comp_aspects, built_descendant=True))
+                    Config.get_aspects(dep['component'], components, conf_aspects, dependency_types, branch, arch,
+                                       users, sand_path, 'built', comp_aspects, built_descendant=True,
+                                       visited=visited)
                 else:
-                    comp_aspects.update(
-                        Config.get_aspects(dep['component'], components, conf_aspects, dependency_types, branch, arch,
-                                           users, sand_path, dep['type'], comp_aspects, built_descendant=False))
+                    Config.get_aspects(dep['component'], components, conf_aspects, dependency_types, branch, arch,
+                                       users, sand_path, dep['type'], comp_aspects, built_descendant=False,
+                                       visited=visited)
         return comp_aspects
 
+    @staticmethod
+    def resolve_aspects(component, components, conf_aspects, aspect_names, dep_type, branch, arch, users, sand_path):
+        """
+        Return the variable injected aspects of a single component for a dependency type. The result is memoized
+        on the index of components and every caller gets its own copy.
+        """
+        memo = ConfigIndex.of(components).memo
+        key = (component['name'], dep_type, tuple(aspect_names), id(conf_aspects), branch, arch, sand_path,
+               tuple(sorted((k, v.get('name')) for k, v in users.items())))
+        cached = memo.get(key)
+        if cached is not None and cached[0] is conf_aspects:
+            aspects = cached[1]
+        else:
+            used_aspects = conf_aspects
+            if 'aspects' in component and len(component['aspects']) > 0:
+                for aspect in component['aspects']:
+                    used_aspects = [a for a in used_aspects if a['name'] != aspect['name']]
+                    used_aspects.append(aspect)
+            aspects = [Config.get_config_aspect(used_aspects, aspect_name, component['name'], dep_type=dep_type)
+                       for aspect_name in aspect_names]
+            aspects = Config.inject_variables_into_aspects(aspects, component['name'], branch, arch, users,
+                                                           sand_path)
+            memo[key] = (conf_aspects, aspects)
+        return [Config.copy_aspect(a) for a in aspects]
+
+    @staticmethod
+    def copy_aspect(aspect):
+        copied = dict(aspect)
+        copied['vcsrepo'] = dict(aspect['vcsrepo'])
+        return copied
+
     @staticmethod
     def inject_variables_into_local_config(conf):
         user_regex = re.compile(r'\$\s*?\{\s*system_user\s*\}', re.IGNORECASE)
@@ -647,33 +937,28 @@ class Config:
 
     @staticmethod
     def inject_variables_into_aspects2(aspects, component, branch, build_type, users, sand_path):
-        component_regex = re.compile(r'\$\s*?\{\s*component\s*\}', re.IGNORECASE)
-        branch_regex = re.compile(r'\$\s*?\{\s*branch\s*\}', re.IGNORECASE)
-        built_regex = re.compile(r'\$\s*?\{\s*built\s*\}', re.IGNORECASE)
-        user_regex = re.compile(r'\$\s*?\{\s*user[^.]*\.\s*([^.]+)\s*\.*name\s*\}', re.IGNORECASE)
-
+        values = {'component': component, 'branch': branch, 'built': build_type}
         modified_aspects = []
         for a in aspects:
-            aspect = deepcopy(a)
-            aspect['name'] = component
-            m = user_regex.search(aspect['vcsrepo']['source'])
-            if m:
-                provider = m.group(1)
+            source = VariableTemplate.get(a['vcsrepo']['source'])
+            source_values = values
+            if source.user:
+                provider, variable = source.user
                 if provider not in users.keys():
                     raise ConfigError("Variable '%s' in the remote config is not defined in the local config."
-                                      % m.group(0))
-                aspect['vcsrepo']['source'] = user_regex.sub(users[provider]['name'], aspect['vcsrepo']['source'])
-            aspect['vcsrepo']['source'] = component_regex.sub(component, aspect['vcsrepo']['source'])
-            aspect['vcsrepo']['source'] = branch_regex.sub(branch, aspect['vcsrepo']['source'])
-            aspect['vcsrepo']['source'] = built_regex.sub(build_type, aspect['vcsrepo']['source'])
-            aspect['vcsrepo']['revision'] = component_regex.sub(component, aspect['vcsrepo']['revision'])
-            aspect['vcsrepo']['revision'] = branch_regex.sub(branch, aspect['vcsrepo']['revision'])
-            aspect['vcsrepo']['revision'] = built_regex.sub(build_type, aspect['vcsrepo']['revision'])
-            aspect['vcsrepo']['built_path'] = os.path.join(sand_path, build_type, component)
-            if aspect['type'] == 'built':
-                aspect['vcsrepo']['path'] = os.path.join(sand_path, build_type, component)
+                                      % variable)
+                source_values = dict(values, user=users[provider]['name'])
+            vcsrepo = dict(a['vcsrepo'])
+            vcsrepo['source'] = source.render(source_values)
+            vcsrepo['revision'] = VariableTemplate.get(a['vcsrepo']['revision'], user_variables=False).render(values)
+            vcsrepo['built_path'] = os.path.join(sand_path, build_type, component)
+            if a['type'] == 'built':
+                vcsrepo['path'] = os.path.join(sand_path, build_type, component)
             else:
-                aspect['vcsrepo']['path'] = os.path.join(sand_path, aspect['type'], component)
+                vcsrepo['path'] = os.path.join(sand_path, a['type'], component)
+            aspect = dict(a)
+            aspect['name'] = component
+            aspect['vcsrepo'] = vcsrepo
             modified_aspects.append(aspect)
         return modified_aspects
 
@@ -696,9 +981,14 @@ class Config:
     def parse_config(config_path):
         if not os.path.isfile(config_path):
             raise ConfigError("Config file '%s' does not exist" % config_path)
+        with open(config_path) as config_file:
+            return Config.parse_config_text(config_file.read(), config_path)
+
+    @staticmethod
+    def parse_config_text(text, config_path):
         try:
             lines = ""
-            for line in open(config_path):
+            for line in text.splitlines():
                 li = line.strip()
                 if not li.startswith("#"):
                     lines += line.rstrip()
@@ -709,30 +999,28 @@ class Config:
         return configuration
 
     @staticmethod
-    def print_aspect_missing(aspect):
+    def get_aspect_report(aspect, key, report):
+        """
+        Run report(vcs) against the repository of an aspect. Returns the aspect with the result stored under key,
+        which is None when the repository hasn't been cloned.
+        """
         vcs = VcsRepo.get_repo(path=aspect['vcsrepo']['path'],
                                provider=aspect['vcsrepo']['provider'],
                                source=aspect['vcsrepo']['source'],
                                revision=aspect['vcsrepo']['revision'],
                                type_=aspect['type'])
         try:
-            vcs.print_missing()
+            result = report(vcs) if vcs.exists() else None
         except CalledProcessError as e:
-            raise VcsError(e, aspect['path'], aspect['source'], aspect['revision'])
+            raise VcsError(e, aspect['vcsrepo']['path'], aspect['vcsrepo']['source'], aspect['vcsrepo']['revision'])
+        return {'component': aspect['name'], 'type': aspect['type'], 'path': vcs.path, key: result}
 
     @staticmethod
-    def print_aspect_status(aspect):
-        vcs = VcsRepo.get_repo(path=aspect['vcsrepo']['path'],
-                               provider=aspect['vcsrepo']['provider'],
-                               source=aspect['vcsrepo']['source'],
-                               revision=aspect['vcsrepo']['revision'],
-                               type_=aspect['type'])
-        try:
-            if vcs.exists():
-                return vcs.print_status()
-            return False
-        except CalledProcessError as e:
-            raise VcsError(e, aspect['path'], aspect['source'], aspect['revision'])
+    def get_aspect_missing(aspect):
+        return Config.get_aspect_report(aspect, 'missing', lambda vcs: vcs.get_missing())
+
+    def get_aspect_status(self, aspect):
+        return Config.get_aspect_report(aspect, 'status', lambda vcs: vcs.get_status(self.fast_status))
 
     @staticmethod
     def reset_config():
@@ -740,24 +1028,200 @@ class Config:
         config = None
 
     @staticmethod
-    def validate_config(conf, type_):
+    def set_config(configuration):
+        """
+        Make configuration the one get_config returns, so a long running process can reuse a warm config.
+        """
+        global config
+        config = configuration
+
+    @staticmethod
+    def get_schema(type_):
+        """
+        Return a config schema and a digest of it. Schemas are read once per process.
+        """
+        with _validators_lock:
+            if type_ not in _schemas:
+                if type_ not in ('remote', 'local'):
+                    raise ConfigError("Only remote and local config types are supported")
+                schema_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                           'config_schemas/%s.schema.json' % type_)
+                with open(schema_path, 'r') as schema_file:
+                    text = schema_file.read()
+                _schemas[type_] = (json.loads(text), hashlib.sha1(text.encode()).hexdigest())
+            return _schemas[type_]
+
+    @staticmethod
+    def get_validator(type_):
+        """
+        Return the compiled validator of a config schema. jsonschema is imported and the schema compiled only
+        when a config actually has to be validated, which a known config never does.
+        """
+        schema = Config.get_schema(type_)[0]
+        with _validators_lock:
+            if type_ not in _validators:
+                from jsonschema import Draft4Validator
+                _validators[type_] = Draft4Validator(schema)
+            return _validators[type_]
+
+    @staticmethod
+    @trace.traced('Config.validate_config')
+    def validate_config(conf, type_, cache_file=None):
+        """
+        Validate a config against its schema. Configs whose content was already validated against the same schema,
+        in this process or according to cache_file, are not validated again.
+        """
         if not isinstance(conf, dict):
             raise ConfigError("The %s configuration must be a valid json object." % type_)
-        if type_ == 'remote':
-            schema_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config_schemas/remote.schema.json')
-        elif type_ == 'local':
-            schema_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config_schemas/local.schema.json')
-        else:
-            raise ConfigError("Only remote and local config types are supported")
-        with open(schema_path, 'r') as schema_file:
-            schema = json.loads(schema_file.read())
-        try:
-            validate(conf, schema)
-        except ValidationError as e:
-            raise ConfigError("The %s configuration file is not valid because: %s" % (type_, e))
+        schema_digest = Config.get_schema(type_)[1]
+        digest = hashlib.sha1(("%s:%s:" % (type_, schema_digest)).encode() +
+                              json.dumps(conf, sort_keys=True).encode()).hexdigest()
+        if digest in _validated:
+            return conf
+        validated = read_json(cache_file, []) if cache_file else []
+        if digest not in validated:
+            from jsonschema.exceptions import best_match
+            error = best_match(Config.get_validator(type_).iter_errors(conf))
+            if error is not None:
+                raise ConfigError("The %s configuration file is not valid because: %s" % (type_, error))
+            if cache_file:
+                write_json(cache_file, (validated + [digest])[-VALIDATED_CACHE_SIZE:])
+        _validated.add(digest)
         return conf
 
 
+class VariableTemplate(object):
+    """
+    A string from the remote config with its ${component}, ${branch}, ${built} and ${user.<provider>.name}
+    variables parsed once, so rendering it is a single join. Templates are cached per string.
+    """
+    pattern = re.compile(r'\$\s*?\{\s*(?:(component)\s*\}|(branch)\s*\}|(built)\s*\}|'
+                         r'user[^.]*\.\s*([^.]+)\s*\.*name\s*\})', re.IGNORECASE)
+    templates = {}
+
+    def __init__(self, text, user_variables=True):
+        self.parts = []
+        # The provider and text of the first user variable. Every user variable is rendered with its name.
+        self.user = None
+        position = 0
+        for m in VariableTemplate.pattern.finditer(text):
+            if m.group(4) is not None:
+                if not user_variables:
+                    continue
+                if self.user is None:
+                    self.user = (m.group(4), m.group(0))
+                variable = 'user'
+            else:
+                variable = (m.group(1) or m.group(2) or m.group(3)).lower()
+            self.parts.append((False, text[position:m.start()]))
+            self.parts.append((True, variable))
+            position = m.end()
+        self.parts.append((False, text[position:]))
+
+    def render(self, values):
+        return ''.join([values[part] if is_variable else part for is_variable, part in self.parts])
+
+    @staticmethod
+    def get(text, user_variables=True):
+        key = (text, user_variables)
+        template = VariableTemplate.templates.get(key)
+        if template is None:
+            template = VariableTemplate.templates[key] = VariableTemplate(text, user_variables)
+        return template
+
+
+class ConfigIndex(object):
+    """
+    Name index over a list of named config entries (components, aspects or commands), built once per list
+    and shared by every lookup. It also holds memoized results derived from the list.
+    """
+    indexes = {}
+    lock = threading.Lock()
+    max_indexes = 64
+
+    def __init__(self, items):
+        self.items = items
+        self.names = {}
+        self.memo = {}
+        for item in items:
+            self.names.setdefault(item['name'], []).append(item)
+
+    @staticmethod
+    def of(items):
+        with ConfigIndex.lock:
+            index = ConfigIndex.indexes.get(id(items))
+            # The index keeps its list alive, so a matching id is only stale if the list was replaced.
+            if index is None or index.items is not items:
+                if len(ConfigIndex.indexes) >= ConfigIndex.max_indexes:
+                    ConfigIndex.indexes.clear()
+                index = ConfigIndex(items)
+                ConfigIndex.indexes[id(items)] = index
+        return index
+
+    def get(self, name):
+        return self.names.get(name, [])
+
+
+class ConfigSnapshots(object):
+    """
+    Reads the remote config of every branch straight from the config repo object store, so branches can be
+    scanned without checking them out. Parsed snapshots are cached in memory and on disk keyed by commit id.
+    """
+    def __init__(self, vcs, cache_dir):
+        self.vcs = vcs
+        self.cache_dir = os.path.join(cache_dir, 'snapshots')
+        self.snapshots = {}
+        self.lock = threading.Lock()
+
+    def get(self, commit):
+        with self.lock:
+            if commit in self.snapshots:
+                return self.snapshots[commit]
+        cache_file = os.path.join(self.cache_dir, '%s.json' % commit)
+        snapshot = read_json(cache_file)
+        if snapshot is None:
+            try:
+                text = self.vcs.show_file(commit, REMOTE_CONF_NAME)
+            except CalledProcessError as e:
+                raise VcsError(e, self.vcs.path, self.vcs.source, commit)
+            name = '%s:%s' % (commit, REMOTE_CONF_NAME)
+            if text is None:
+                raise ConfigError("Config file '%s' does not exist" % name)
+            snapshot = {
+                'commit': commit,
+                'config': Config.validate_config(Config.parse_config_text(text, name), 'remote'),
+            }
+            write_json(cache_file, snapshot)
+        with self.lock:
+            self.snapshots[commit] = snapshot
+        return snapshot
+
+    def prune(self, commits):
+        """
+        Remove cached snapshots of commits that no branch points to anymore.
+        """
+        keep = set('%s.json' % c for c in commits)
+        try:
+            for name in os.listdir(self.cache_dir):
+                if name.endswith('.json') and name not in keep:
+                    os.remove(os.path.join(self.cache_dir, name))
+        except OSError:
+            pass
+
+    def get_branches(self, jobs=DEFAULT_JOBS, branches=None):
+        """
+        Return a dict of branch name to snapshot for every remote branch, or just the given branches.
+        """
+        revisions = self.vcs.branch_revisions()
+        if branches is not None:
+            revisions = dict((b, c) for b, c in revisions.items() if b in branches)
+        else:
+            self.prune(revisions.values())
+        commits = sorted(set(revisions.values()))
+        snapshots = dict(zip(commits, run_in_parallel(self.get, commits, jobs)))
+        return dict((b, snapshots[revisions[b]]) for b in sorted(revisions.keys()))
+
+
 class ComponentTree(object):
     def __init__(self, name, type_="", children=[]):
         self.name = name
@@ -778,76 +1242,26 @@ class ComponentTree(object):
 
     @staticmethod
     def clean_deps(deps):
-        already_built_prev = list()
+        already_built_prev = set()
         for i, _ in enumerate(deps):
-            already_built_curr = set()
+            already_built_curr = []
             for d in deps[i]:
                 if d not in already_built_prev:
-                    already_built_curr.add(d)
-            deps[i] = list(already_built_curr)
-            already_built_prev.extend(list(already_built_curr))
+                    already_built_curr.append(d)
+                    already_built_prev.add(d)
+            deps[i] = already_built_curr
         return [d for d in deps if len(d) > 0]
 
-    @staticmethod
-    def filter_dependencies_that_depend_on_component(me, components, dependencies):
-        components_that_depend_on_me = []
-        for component in dependencies:
-            if [d for d in Config.get_config_component(components, component)['dependencies'] if
-                    d['type'] == 'built' and d['component'] == me]:
-                components_that_depend_on_me.append(component)
-        return components_that_depend_on_me
-
-    @staticmethod
-    def pull_deps_down_one_level(dependencies, components):
-        previously_pulled_down = list()
-        for i, _ in enumerate(dependencies):
-            if len(dependencies) < i + 2:
-                break
-            cant_be_pulled_down = list()
-            for component in dependencies[i]:
-                cant_be_pulled_down.extend(
-                    ComponentTree.filter_dependencies_that_depend_on_component(component, components,
-                                                                               dependencies[i + 1]))
-            dependencies[i] = [x for x in dependencies[i] if x not in previously_pulled_down] + [x for x in dependencies[i+1] if x not in cant_be_pulled_down]
-            previously_pulled_down = dependencies[i]
-        return dependencies
-
-    @staticmethod
-    def dependencies_are_equal(list1, list2):
-        first_set = set(map(tuple, list1))
-        second_set = set(map(tuple, list2))
-        return first_set.symmetric_difference(second_set)
-
-    @staticmethod
-    def optimize_deps(deps, components):
-        while True:
-            new_deps = ComponentTree.pull_deps_down_one_level(copy.deepcopy(deps), components)
-            if not ComponentTree.dependencies_are_equal(deps, new_deps):
-                break
-            deps = new_deps
-        return deps
+    def collect_levels(self, levels, level=0):
+        if len(levels) <= level:
+            levels.append([])
+        levels[level].append(self.name)
+        for child in self.children:
+            child.collect_levels(levels, level + 1)
+        return levels
 
     def get_deps(self):
-        tree = self.__str__().replace('\n', '')
-        build_info = {}
-        while tree.find('\t') != -1:
-            level = 0
-            while tree.startswith('\t'):
-                tree = tree[1:]
-                level += 1
-            next_ = tree.find('\t')
-            if level not in build_info:
-                build_info[level] = []
-            build_info[level].append(tree[0:tree.find('(')])
-            tree = tree[next_:]
-        if 0 not in build_info:
-            build_info[0] = [tree[0:tree.find('(')]]
-        sorted_tuples = sorted(build_info.items(), reverse=True)
-        _, dependencies = zip(*sorted_tuples)
-        return self.clean_deps(list(dependencies))
-
-    def get_build_up_to_deps(self, components):
-        return self.optimize_deps(self.get_deps(), components)
+        return self.clean_deps(list(reversed(self.collect_levels([]))))
 
     def order_deps(self):
         deps = self.get_deps()
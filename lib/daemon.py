@@ -0,0 +1,203 @@
+import importlib.machinery
+import importlib.util
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+import traceback
+from lib.client import get_socket_path
+from lib.config import Config
+from lib.exceptions import CommandError
+from lib.utils import DEFAULT_JOBS
+from vcs.refcache import remote_refs
+
+# The tools sandmand runs commands of. Each one lists the commands it lets the daemon run in DAEMON_COMMANDS.
+PROGRAMS = ['sm', 'sandman-repos']
+BIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Seconds between checks of the warm configs and refreshes of the remote refs
+REFRESH_INTERVAL = 60
+# Seconds after which the refs of a remote no command asked for are no longer refreshed
+REFS_EXPIRY = 30 * 60
+
+
+class ReplyStream(object):
+    """
+    A text stream that sends everything written to it to the client as json lines tagged with the stream name.
+    """
+    def __init__(self, wfile, stream, lock):
+        self.wfile = wfile
+        self.stream = stream
+        self.lock = lock
+
+    def write(self, data):
+        if data:
+            with self.lock:
+                self.wfile.write(json.dumps({'stream': self.stream, 'data': data}).encode() + b'\n')
+        return len(data)
+
+    def flush(self):
+        with self.lock:
+            self.wfile.flush()
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.server.sandmand.handle(json.loads(self.rfile.readline().decode()), self.wfile)
+
+
+class Daemon(object):
+    """
+    Runs the read only commands of the sandman tools for clients on a UNIX socket. Configs, sandbox facts and
+    remote refs stay loaded between commands and are refreshed in the background. Commands run one at a time
+    because they write to the process wide stdout, working directory and environment, which are the ones of the
+    client. The background refresh runs in the environment of the latest client, so it reaches remotes the same
+    way the commands do.
+    """
+    def __init__(self, socket_path=None, interval=REFRESH_INTERVAL, jobs=DEFAULT_JOBS):
+        self.socket_path = socket_path or get_socket_path()
+        self.interval = interval
+        self.jobs = jobs
+        self.lock = threading.Lock()
+        self.configs = {}
+        self.programs = {}
+        self.environ = None
+
+    def start(self):
+        """
+        Listen on the socket until the process is stopped.
+        """
+        os.makedirs(os.path.dirname(self.socket_path), mode=0o700, exist_ok=True)
+        if os.path.exists(self.socket_path):
+            if Daemon.is_listening(self.socket_path):
+                raise CommandError("sandmand is already listening on %s" % self.socket_path)
+            os.remove(self.socket_path)
+        self.get_config(Config.local_config_to_parse())
+        server = socketserver.UnixStreamServer(self.socket_path, RequestHandler)
+        server.sandmand = self
+        os.chmod(self.socket_path, 0o600)
+        refresher = threading.Thread(target=self.refresh_loop)
+        refresher.daemon = True
+        refresher.start()
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            os.remove(self.socket_path)
+
+    @staticmethod
+    def is_listening(socket_path):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            connection.connect(socket_path)
+            return True
+        except OSError:
+            return False
+        finally:
+            connection.close()
+
+    def get_config(self, config_path, refresh=False):
+        """
+        Return the warm config of config_path. It is loaded again when the local config file changed and its config
+        repo is fetched when it is stale or refresh is set.
+        """
+        stamp = os.stat(config_path).st_mtime_ns if os.path.exists(config_path) else None
+        entry = self.configs.get(config_path)
+        if entry is None or entry[0] != stamp:
+            entry = self.configs[config_path] = (stamp, Config(None, config_path, refresh))
+        elif refresh or not entry[1].is_fresh():
+            entry[1].refresh()
+        if refresh:
+            remote_refs.clear()
+        return entry[1]
+
+    def get_program(self, name):
+        if name not in self.programs:
+            path = os.path.join(BIN_DIR, name)
+            loader = importlib.machinery.SourceFileLoader('sandman_%s' % name.replace('-', '_'), path)
+            spec = importlib.util.spec_from_file_location(loader.name, path, loader=loader)
+            if hasattr(importlib.util, 'module_from_spec'):
+                module = importlib.util.module_from_spec(spec)
+                loader.exec_module(module)
+            else:
+                # Python 3.4
+                module = loader.load_module()
+            self.programs[name] = module
+        return self.programs[name]
+
+    def handle(self, request, wfile):
+        lock = threading.Lock()
+        stdout, stderr = sys.stdout, sys.stderr
+        with self.lock:
+            cwd = os.getcwd()
+            environ = Daemon.set_environ(request['env'])
+            self.environ = request['env']
+            sys.stdout = ReplyStream(wfile, 'out', lock)
+            sys.stderr = ReplyStream(wfile, 'err', lock)
+            try:
+                os.chdir(request['cwd'])
+                status = self.run(request['program'], request['argv'])
+            finally:
+                sys.stdout, sys.stderr = stdout, stderr
+                os.chdir(cwd)
+                Daemon.set_environ(environ)
+        try:
+            wfile.write(json.dumps({'local': True} if status is None else {'exit': status}).encode() + b'\n')
+        except OSError:
+            pass
+
+    @staticmethod
+    def set_environ(environ):
+        """
+        Replace the environment of the process, which subprocesses inherit. Returns the previous one.
+        """
+        previous = dict(os.environ)
+        os.environ.clear()
+        os.environ.update(environ)
+        return previous
+
+    def run(self, program, argv):
+        """
+        Run a command of program the way the tool itself would. Returns its exit status, or None when the command
+        isn't one the daemon runs.
+        """
+        if program not in PROGRAMS:
+            return None
+        try:
+            module = self.get_program(program)
+            parser = module.get_parser()
+            parser.prog = program
+            args = parser.parse_args(argv)
+            if args.command not in module.DAEMON_COMMANDS:
+                return None
+            Config.set_config(self.get_config(args.config_path, args.refresh))
+            module.main(**vars(args))
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                return e.code or 0
+            print(e.code, file=sys.stderr)
+            return 1
+        except Exception:
+            traceback.print_exc()
+            return 1
+        return 0
+
+    def refresh_loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                with self.lock:
+                    environ = Daemon.set_environ(self.environ) if self.environ is not None else None
+                    try:
+                        for _, config in list(self.configs.values()):
+                            if not config.is_fresh():
+                                config.refresh()
+                        remote_refs.refresh(self.jobs, REFS_EXPIRY)
+                    finally:
+                        if environ is not None:
+                            Daemon.set_environ(environ)
+            except Exception:
+                # Commands may have stderr redirected to their client
+                traceback.print_exc(file=sys.__stderr__)
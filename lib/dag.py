@@ -0,0 +1,105 @@
+from lib.exceptions import ConfigError
+
+
+class DependencyGraph(object):
+    """
+    Adjacency index over the components of a remote config. It is built once from the components list
+    and answers dependency questions without scanning the list again.
+    """
+    def __init__(self, components):
+        self.components = {}
+        self.built_deps = {}
+        for component in components:
+            self.components[component['name']] = component
+            self.built_deps[component['name']] = set(d['component'] for d in component.get('dependencies', [])
+                                                     if d['type'] == 'built')
+
+    def component(self, name):
+        if name not in self.components:
+            raise ConfigError("Component '%s' was not found." % name)
+        return self.components[name]
+
+    def is_terminal(self, name):
+        attributes = self.component(name).get('attributes', {})
+        return attributes.get('terminal_dependency', False)
+
+    def build_up_to_children(self, name, root):
+        """
+        The built dependencies of a component that take part in a build up to. Terminal dependencies are
+        not followed unless they are the component being built.
+        """
+        if name != root and self.is_terminal(name):
+            return []
+        children = []
+        for dep in self.component(name)['dependencies']:
+            if dep['type'] == 'built' and dep['component'] not in children and \
+                    not self.component(dep['component'])['attributes']['exclude_bu2']:
+                children.append(dep['component'])
+        return children
+
+    def depends_on(self, name, dependency):
+        return dependency in self.built_deps.get(name, ())
+
+    def levels(self, root, children):
+        """
+        Layer everything reachable from root by its longest distance from root using a Kahn style topological
+        walk. Returns the layers deepest first, each sorted by name.
+        """
+        edges = {}
+        in_degree = {root: 0}
+        stack = [root]
+        while stack:
+            name = stack.pop()
+            edges[name] = children(name)
+            for child in edges[name]:
+                if child not in in_degree:
+                    in_degree[child] = 0
+                    stack.append(child)
+                in_degree[child] += 1
+
+        depth = {root: 0}
+        ready = [root]
+        visited = 0
+        while ready:
+            name = ready.pop()
+            visited += 1
+            for child in edges[name]:
+                depth[child] = max(depth.get(child, 0), depth[name] + 1)
+                in_degree[child] -= 1
+                if in_degree[child] == 0:
+                    ready.append(child)
+        if visited != len(edges):
+            cycle = sorted(name for name, degree in in_degree.items() if degree > 0)
+            raise ConfigError("Circular dependency between components: %s" % ", ".join(cycle))
+
+        layers = [[] for _ in range(max(depth.values()) + 1)]
+        for name in sorted(depth.keys()):
+            layers[depth[name]].append(name)
+        return list(reversed(layers))
+
+    def pull_down_one_level(self, levels):
+        """
+        Move every component one level down when it doesn't depend on anything in the level below it.
+        """
+        previously_pulled_down = set()
+        for i, _ in enumerate(levels):
+            if len(levels) < i + 2:
+                break
+            below = set(levels[i])
+            cant_be_pulled_down = set(c for c in levels[i + 1] if self.built_deps.get(c, set()) & below)
+            levels[i] = [x for x in levels[i] if x not in previously_pulled_down] + \
+                [x for x in levels[i + 1] if x not in cant_be_pulled_down]
+            previously_pulled_down = set(levels[i])
+        return levels
+
+    def build_up_to_levels(self, root):
+        """
+        Return the lists of components that have to be built, in order, to build root.
+        """
+        levels = self.levels(root, lambda name: self.build_up_to_children(name, root))
+        while True:
+            new_levels = self.pull_down_one_level([list(level) for level in levels])
+            if new_levels == levels:
+                break
+            levels = new_levels
+        return levels
@@ -64,3 +64,17 @@ class VcsError(SandmanException):
 
     def __str__(self):
         return self.message
+
+
+class ParallelError(SandmanException):
+    """SandmanException raised when one or more tasks that were run in parallel failed
+
+    Attributes:
+         errors -- the exceptions raised by the failed tasks
+    """
+    def __init__(self, errors):
+        self.errors = errors
+        self.message = "\n".join(str(e) for e in errors)
+
+    def __str__(self):
+        return self.message
@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+from lib.cache import read_json, write_json
+
+PENDING = 'pending'
+CLONING = 'cloning'
+DONE = 'done'
+FAILED = 'failed'
+JOURNAL_VERSION = 1
+# Seconds between the progress lines of the aspects that are still cloning
+PROGRESS_INTERVAL = 5
+
+
+class InitJournal(object):
+    """
+    The state of every aspect of a sandbox that is being initialized, saved after every change so an init that
+    failed or was interrupted can be resumed. An aspect is pending, cloning, done or failed, done aspects keep the
+    revision they were cloned at. Prints a line when an aspect starts, the size and throughput of the aspects
+    still cloning every few seconds while the progress is shown, and a line with the throughput of every aspect as
+    it finishes. Safe to update from several threads at once.
+    """
+    def __init__(self, path, sandbox_path, aspects):
+        self.path = path
+        self.sandbox_path = sandbox_path
+        self.lock = threading.Lock()
+        self.started = {}
+        self.stopped = threading.Event()
+        saved = read_json(path, {})
+        saved = saved.get('aspects', {}) if saved.get('version') == JOURNAL_VERSION else {}
+        self.aspects = {}
+        for aspect in aspects:
+            key = self.key(aspect)
+            entry = saved.get(key, {})
+            if entry.get('state') == DONE and not os.path.isdir(aspect['vcsrepo']['path']):
+                entry = {}
+            self.aspects[key] = {
+                'component': aspect['name'],
+                'type': aspect['type'],
+                'state': entry.get('state', PENDING),
+                'revision': entry.get('revision'),
+            }
+            if entry.get('error'):
+                self.aspects[key]['error'] = entry['error']
+        self.total = len(self.aspects)
+        self.finished = self.count(DONE)
+
+    def key(self, aspect):
+        return os.path.relpath(aspect['vcsrepo']['path'], self.sandbox_path)
+
+    def count(self, state):
+        return len([a for a in self.aspects.values() if a['state'] == state])
+
+    def save(self):
+        with self.lock:
+            self._save()
+
+    def _save(self):
+        write_json(self.path, {'version': JOURNAL_VERSION, 'aspects': self.aspects})
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def is_done(self, aspect):
+        return self.aspects[self.key(aspect)]['state'] == DONE
+
+    def was_interrupted(self, aspect):
+        """
+        Whether the clone of the aspect was cut off or failed the last time, so its checkout may be incomplete.
+        """
+        return self.aspects[self.key(aspect)]['state'] in (CLONING, FAILED)
+
+    def start(self, aspect):
+        key = self.key(aspect)
+        with self.lock:
+            self.started[key] = (time.perf_counter(), aspect['vcsrepo']['path'])
+            self.aspects[key]['state'] = CLONING
+            self.aspects[key].pop('error', None)
+            self._save()
+            print("[%s] %-40s cloning" % (self.blank(), key))
+
+    def finish(self, aspect, revision):
+        key = self.key(aspect)
+        size = InitJournal.disk_usage(aspect['vcsrepo']['path'])
+        with self.lock:
+            seconds = max(time.perf_counter() - self.started.pop(key)[0], 0.001)
+            self.aspects[key].update({'state': DONE, 'revision': revision})
+            self._save()
+            self.finished += 1
+            print("[%*d/%d] %-40s %9s in %6.1fs %9s/s" % (len(str(self.total)), self.finished, self.total, key,
+                                                          InitJournal.format_size(size), seconds,
+                                                          InitJournal.format_size(size / seconds)))
+
+    def fail(self, aspect, error):
+        key = self.key(aspect)
+        with self.lock:
+            self.started.pop(key, None)
+            self.aspects[key].update({'state': FAILED, 'error': str(error)})
+            self._save()
+            print("[%s] %-40s failed" % (self.blank(), key))
+
+    def blank(self):
+        return '-' * (len(str(self.total)) * 2 + 1)
+
+    def show_progress(self, interval=PROGRESS_INTERVAL):
+        """
+        Print the progress of the aspects that are cloning every interval seconds until stop_progress is called.
+        """
+        self.stopped.clear()
+        thread = threading.Thread(target=self._progress_loop, args=(interval,))
+        thread.daemon = True
+        thread.start()
+
+    def stop_progress(self):
+        self.stopped.set()
+
+    def _progress_loop(self, interval):
+        while not self.stopped.wait(interval):
+            with self.lock:
+                started = dict(self.started)
+            now = time.perf_counter()
+            # Measured outside the lock, walking a large checkout takes a while
+            sizes = [(key, InitJournal.disk_usage(path), max(now - start, 0.001))
+                     for key, (start, path) in sorted(started.items())]
+            with self.lock:
+                for key, size, seconds in sizes:
+                    if key in self.started and not self.stopped.is_set():
+                        print("[%s] %-40s %9s in %6.1fs %9s/s" % (self.blank(), key, InitJournal.format_size(size),
+                                                                  seconds, InitJournal.format_size(size / seconds)))
+
+    @staticmethod
+    def disk_usage(path):
+        size = 0
+        for root, _, files in os.walk(path):
+            for name in files:
+                try:
+                    size += os.lstat(os.path.join(root, name)).st_size
+                except OSError:
+                    pass
+        return size
+
+    @staticmethod
+    def format_size(size):
+        for unit in ['B', 'KiB', 'MiB']:
+            if size < 1024:
+                return "%.1f %s" % (size, unit)
+            size /= 1024.0
+        return "%.1f GiB" % size
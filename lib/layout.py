@@ -0,0 +1,58 @@
+import os
+import re
+from lib.cache import read_json
+from lib.exceptions import SandboxNameError
+
+# Where sandman keeps its files. Only light modules are imported here so the tools can show their help,
+# complete arguments and list sandbox commands without loading the config.
+LOCAL_CONF = os.path.join(os.path.expanduser('~'), '.sand.conf')
+DEFAULT_CONF = '/opt/sandman/etc/config.json'
+STANDARD_NAME_PAT = re.compile(r'^([^.]+)\.([^.]+)\.(.+)$', re.IGNORECASE)
+COMMAND_MANIFEST = os.path.join('run', 'commands.json')
+PUBLISH_CHECKOUT = os.path.join('run', 'publish')
+FACTS_CACHE = os.path.join('run', 'facts.json')
+INIT_JOURNAL = os.path.join('run', 'init.json')
+
+
+def local_config_to_parse():
+    config_path = LOCAL_CONF
+    if not os.path.exists(config_path):
+        config_path = DEFAULT_CONF
+    return config_path
+
+
+def get_sandbox_from_path(path):
+    path = os.path.abspath(path)
+    segments = path.split('/')
+    i = len(segments) - 1
+    while i >= 0:
+        m = STANDARD_NAME_PAT.match(segments[i])
+        if m:
+            return '/'.join(segments[0:i]), segments[i]
+        i -= 1
+    return None, None
+
+
+def parse_sandbox_name(name):
+    """
+    Split a sandbox name into its 3 constituent pieces (component, branch, task).
+    Return a 3-tuple. Raises SandboxNameError if name is invalid.
+    """
+    m = STANDARD_NAME_PAT.match(name)
+    if not m:
+        raise SandboxNameError(name)
+    return m.group(1), m.group(2), m.group(3)
+
+
+def read_command_manifest(path):
+    """
+    Return the commands saved by write_command_manifest for the sandbox at path, or None if they are
+    missing or the config branch moved since they were written
+    """
+    manifest = read_json(os.path.join(path, COMMAND_MANIFEST))
+    if not manifest:
+        return None
+    stamp = read_json(manifest['fetch_stamp'])
+    if not stamp or stamp.get('branches', {}).get(manifest['branch']) != manifest['config_commit']:
+        return None
+    return manifest['commands']
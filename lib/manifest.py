@@ -0,0 +1,132 @@
+import collections
+import hashlib
+import mmap
+import os
+from lib.cache import read_json, write_json
+from lib.utils import DEFAULT_JOBS
+
+try:
+    from os import scandir
+except ImportError:
+    # Python 3.4
+    scandir = None
+
+MANIFEST_NAME = 'manifest.txt'
+HASH_BLOCK_SIZE = 1024 * 1024
+# Files at least this big are hashed through mmap instead of being read in blocks
+MMAP_THRESHOLD = 64 * 1024 * 1024
+
+
+def file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                digest.update(m)
+        else:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def _list_dir(path):
+    """
+    The (name, is_dir, stat) of every entry in path sorted by name. Symlinks are followed.
+    """
+    if scandir:
+        entries = []
+        for entry in scandir(path):
+            is_dir = entry.is_dir()
+            entries.append((entry.name, is_dir, None if is_dir else entry.stat()))
+    else:
+        entries = []
+        for name in os.listdir(path):
+            entry_path = os.path.join(path, name)
+            is_dir = os.path.isdir(entry_path)
+            entries.append((name, is_dir, None if is_dir else os.stat(entry_path)))
+    return sorted(entries)
+
+
+def walk_files(folder, skip):
+    """
+    Yield the relative path and stat of every file below folder, one directory at a time. Entries whose name
+    contains skip are left out.
+    """
+    stack = ['']
+    while stack:
+        relative_path = stack.pop()
+        subdirectories = []
+        for name, is_dir, stat in _list_dir(os.path.join(folder, relative_path)):
+            if skip in name:
+                continue
+            path = os.path.join(relative_path, name)
+            if is_dir:
+                subdirectories.append(path)
+            elif path != MANIFEST_NAME:
+                yield path, stat
+        stack.extend(reversed(subdirectories))
+
+
+class ManifestHasher(object):
+    """
+    Hashes manifest entries on a thread pool. Digests are kept in a stat cache so files with the same size and
+    mtime as on the previous publish aren't read again.
+    """
+    def __init__(self, folder, cache_path, jobs=DEFAULT_JOBS):
+        self.folder = folder
+        self.cache_path = cache_path
+        self.jobs = jobs
+        self.cache = read_json(cache_path, {}) if cache_path else {}
+        self.new_cache = {}
+
+    def digest(self, relative_path, stat):
+        cached = self.cache.get(relative_path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            digest = cached[2]
+        else:
+            digest = file_digest(os.path.join(self.folder, relative_path))
+        self.new_cache[relative_path] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def lines(self, files):
+        """
+        Yield manifest lines with a hash column in the order of files. Only a bounded number of files are
+        hashed ahead of the line being written.
+        """
+        pending = collections.deque()
+        # Imported here like in run_in_parallel, only hashed manifests need a pool
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=max(1, self.jobs)) as executor:
+            for relative_path, stat in files:
+                pending.append((relative_path, stat, executor.submit(self.digest, relative_path, stat)))
+                if len(pending) >= self.jobs * 4:
+                    yield self._line(*pending.popleft())
+            while pending:
+                yield self._line(*pending.popleft())
+        if self.cache_path:
+            write_json(self.cache_path, self.new_cache)
+
+    @staticmethod
+    def _line(relative_path, stat, future):
+        return '%s,%s,%s' % (relative_path, stat.st_size, future.result())
+
+
+def write_manifest(manifest_file, folder, vcs_hidden_folder, header, hash_files=False, cache_path=None,
+                   jobs=DEFAULT_JOBS):
+    """
+    Write the manifest of folder while walking it. Every line has the path and size of a file and, with
+    hash_files, its sha1.
+    """
+    files = walk_files(folder, vcs_hidden_folder)
+    if hash_files:
+        lines = ManifestHasher(folder, cache_path, jobs).lines(files)
+    else:
+        lines = ('%s,%s' % (relative_path, stat.st_size) for relative_path, stat in files)
+    with open(manifest_file, 'w') as f:
+        f.write(header)
+        f.write('\n')
+        separator = ''
+        for line in lines:
+            f.write(separator)
+            f.write(line)
+            separator = '\n'
@@ -0,0 +1,118 @@
+import fnmatch
+import os
+import shutil
+from lib.manifest import file_digest
+from lib.utils import run_in_parallel, DEFAULT_JOBS
+from vcs import PUBLISH_IGNORE
+
+
+def is_ignored(name, ignore):
+    return any(fnmatch.fnmatch(name, pattern) for pattern in ignore)
+
+
+def remove_path(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+
+
+def list_files(path, rel_path):
+    """
+    The relative paths of every file below path, which is rel_path relative to the tree root.
+    """
+    if os.path.islink(path) or not os.path.isdir(path):
+        return [rel_path]
+    files = []
+    for root, dirs, names in os.walk(path):
+        rel_root = os.path.join(rel_path, os.path.relpath(root, path))
+        files.extend(os.path.normpath(os.path.join(rel_root, n)) for n in names)
+        files.extend(os.path.normpath(os.path.join(rel_root, d)) for d in dirs if os.path.islink(os.path.join(root, d)))
+    return files
+
+
+def sync_tree(source, target, skip=(), ignore=PUBLISH_IGNORE, jobs=DEFAULT_JOBS):
+    """
+    Make target a copy of source while only touching the files that differ. Files with the same size and
+    mtime are taken as equal, files with the same size but another mtime are hashed. Top level entries named
+    in skip are left alone on both sides and names matching ignore are never copied.
+    Returns the relative paths that were changed or removed in target.
+    """
+    changed = []
+    to_hash = []
+    seen = set()
+    for root, dirs, files in os.walk(source):
+        rel_root = os.path.relpath(root, source)
+        if rel_root == '.':
+            rel_root = ''
+            dirs[:] = [d for d in dirs if d not in skip]
+            files = [f for f in files if f not in skip]
+        entries = [f for f in files if not is_ignored(f, ignore)]
+        for d in list(dirs):
+            if is_ignored(d, ignore):
+                dirs.remove(d)
+            elif os.path.islink(os.path.join(root, d)):
+                # Links to directories are published as links
+                dirs.remove(d)
+                entries.append(d)
+            else:
+                rel = os.path.join(rel_root, d)
+                seen.add(rel)
+                target_dir = os.path.join(target, rel)
+                if os.path.lexists(target_dir) and (os.path.islink(target_dir) or not os.path.isdir(target_dir)):
+                    changed.append(rel)
+                    os.remove(target_dir)
+                os.makedirs(target_dir, exist_ok=True)
+
+        for name in entries:
+            rel = os.path.join(rel_root, name)
+            seen.add(rel)
+            src = os.path.join(source, rel)
+            dst = os.path.join(target, rel)
+            if os.path.islink(src):
+                if not os.path.islink(dst) or os.readlink(dst) != os.readlink(src):
+                    if os.path.lexists(dst):
+                        remove_path(dst)
+                    os.symlink(os.readlink(src), dst)
+                    changed.append(rel)
+                continue
+            if not os.path.lexists(dst) or os.path.islink(dst) or os.path.isdir(dst):
+                if os.path.lexists(dst):
+                    changed.extend(list_files(dst, rel))
+                    remove_path(dst)
+                shutil.copy2(src, dst)
+                changed.append(rel)
+                continue
+            src_stat = os.stat(src)
+            dst_stat = os.stat(dst)
+            if src_stat.st_size != dst_stat.st_size:
+                shutil.copy2(src, dst)
+                changed.append(rel)
+            elif src_stat.st_mtime_ns != dst_stat.st_mtime_ns:
+                to_hash.append(rel)
+
+    differs = run_in_parallel(lambda rel: file_digest(os.path.join(source, rel)) != file_digest(os.path.join(target, rel)),
+                              to_hash, jobs)
+    for rel, differ in zip(to_hash, differs):
+        if differ:
+            shutil.copy2(os.path.join(source, rel), os.path.join(target, rel))
+            changed.append(rel)
+
+    for root, dirs, files in os.walk(target):
+        rel_root = os.path.relpath(root, target)
+        if rel_root == '.':
+            rel_root = ''
+            dirs[:] = [d for d in dirs if d not in skip]
+            files = [f for f in files if f not in skip]
+        for d in list(dirs):
+            rel = os.path.join(rel_root, d)
+            if rel not in seen:
+                dirs.remove(d)
+                changed.extend(list_files(os.path.join(root, d), rel))
+                remove_path(os.path.join(root, d))
+        for name in files:
+            rel = os.path.join(rel_root, name)
+            if rel not in seen:
+                os.remove(os.path.join(root, name))
+                changed.append(rel)
+    return changed
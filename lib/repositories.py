@@ -1,12 +1,15 @@
+import os
 from lib.config import Config
+from lib.utils import DEFAULT_JOBS
 
 
 class Repositories:
-    def __init__(self, config=None):
+    def __init__(self, config=None, jobs=DEFAULT_JOBS):
         if not config:
             self.config = Config.get_config()
         else:
             self.config = config
+        self.jobs = jobs
         self.build_type = "all"
         self.dep_types = {
             "code": [
@@ -20,7 +23,12 @@ class Repositories:
         }
 
     def get_build_info(self):
-        return self.config.get_build_info(self.build_type, self.dep_types)
+        return self.config.get_build_info(self.build_type, self.dep_types, self.jobs)
 
     def get_repository_changesets(self, branch):
-        return self.config.get_repository_changesets(self.build_type, self.dep_types, branch)
+        return self.config.get_repository_changesets(self.build_type, self.dep_types, branch, self.jobs)
+
+    def get_changeset_changes(self, branch, state_file=None):
+        if not state_file:
+            state_file = os.path.join(self.config.cache_dir, 'changesets', '%s.json' % branch)
+        return self.config.get_changeset_changes(self.build_type, self.dep_types, state_file, branch, self.jobs)
@@ -1,61 +1,76 @@
 import os
-import re
-from lib.exceptions import SandboxNameError
 from lib.exceptions import CommandError
 from lib.exceptions import SandboxExistsError
 from lib.exceptions import SandboxNotExistsError
 from lib.exceptions import SandmanException
 from lib.config import Config
 from lib.utils import prompt_question
+from lib.utils import run_in_parallel
+from lib.utils import DEFAULT_JOBS
+from lib.cache import read_json, write_json
 import shutil
 from subprocess import Popen
 import stat
 import sys
 from vcs.vcsrepo import VcsRepo
 import json
+from copy import deepcopy
+from lib.publish import sync_tree
+from lib import layout
+from lib.layout import COMMAND_MANIFEST, PUBLISH_CHECKOUT, FACTS_CACHE, INIT_JOURNAL
+from lib.journal import InitJournal
 
-STANDARD_NAME_PAT = re.compile(r'^([^.]+)\.([^.]+)\.(.+)$', re.IGNORECASE)
+# The facts loaded in this process by sandbox path, so a long running process doesn't read them again
+_facts = {}
 
 
 class Sandbox:
-    def __init__(self, base_dir, sandbox_name, config=None, debug=False, bu2_components=""):
+    def __init__(self, base_dir, sandbox_name, config=None, debug=False, bu2_components="", jobs=DEFAULT_JOBS,
+                 output='text', incremental=False):
         self.path = os.path.join(base_dir, sandbox_name)
         self.base_dir = base_dir
         self.name = sandbox_name
         self.debug = debug
+        self.jobs = jobs
+        self.output = output
+        self.incremental = incremental
         self.bu2_components = bu2_components.split(",")
         self.top, self.branch, self.type = self.parse_sandbox_name(sandbox_name)
         if not config:
             self.config = Config.get_config()
         else:
             self.config = config
-        self.facts = self.config.gather_facts(self.top, self.branch, self.type, self.path)
+        self.facts_key = self.config.facts_key(self.top, self.branch, self.type, self.path)
+        self.facts = self.load_facts()
 
     def remove(self):
         """
         Removes the sandbox
         """
-        local_changes = False
         if not os.path.isdir(self.path):
             print("The sandbox was not there to remove.")
             return
 
-        for aspect in self.facts['aspects']:
-            if self.config.print_aspect_status(aspect):
-                local_changes = True
-        if local_changes and not prompt_question("Are you sure you want to lose local changes on sandbox %s?" % self.name):
+        changed = self.scan_aspects(self.config.get_aspect_status, 'status')
+        self.print_report(changed, Sandbox.format_status, Sandbox.format_status_porcelain, 'text')
+        if changed and not prompt_question("Are you sure you want to lose local changes on sandbox %s?" % self.name):
                 return
         shutil.rmtree(self.path)
 
     def init(self):
         """
-        Pulls down the correct component aspects.
+        Pulls down the correct component aspects. An init that failed or was interrupted is resumed from its journal:
+        aspects that are done are kept and only the others are cloned again.
         """
-        if os.path.isdir(self.path):
+        journal_path = os.path.join(self.path, INIT_JOURNAL)
+        if os.path.isdir(self.path) and not os.path.isfile(journal_path):
             raise SandboxExistsError(self.name, self.base_dir)
-        else:
-            os.makedirs(os.path.join(self.path, 'run'))
-        self._clone_or_update_aspects(force=True)
+        os.makedirs(os.path.join(self.path, 'run'), exist_ok=True)
+        journal = InitJournal(journal_path, self.path, [a for a in self.facts['aspects'] if Sandbox.is_cloned(a)])
+        if journal.finished:
+            print("Resuming sandbox %s, %d of %d aspects are done." % (self.name, journal.finished, journal.total))
+        journal.save()
+        self._clone_or_update_aspects(force=True, journal=journal)
 
     def update(self):
         """
@@ -69,22 +84,42 @@ class Sandbox:
         """
         Prepare the build directory for a publish
         """
+        if self.incremental:
+            self._update_publish_checkout()
+            vcsrepo = self.facts['top_built_aspect']['vcsrepo']
+            os.makedirs(vcsrepo['path'], exist_ok=True)
+            VcsRepo.get_repo(path=vcsrepo['path'],
+                             provider=vcsrepo['provider'],
+                             source=vcsrepo['source'],
+                             revision=vcsrepo['revision'],
+                             type_=self.facts['top_built_aspect']['type']).publish_prep()
+            return
         vcs = self.config.clone_or_update_aspect(self.facts['top_built_aspect'], force=True)
         vcs.publish_prep()
 
+    def _update_publish_checkout(self):
+        """
+        Clone or update the checkout of the top built aspect that incremental publishes are synced into. It is
+        kept in run/ so the build output directory stays a plain directory.
+        """
+        aspect = deepcopy(self.facts['top_built_aspect'])
+        aspect['vcsrepo']['path'] = os.path.join(self.path, PUBLISH_CHECKOUT, self.top)
+        aspect['clone'] = True
+        return self.config.clone_or_update_aspect(aspect, force=True)
+
     def bu2_dependencies(self):
         """
         Return a json list of lists of components that need to be built in order for the component to be built.
         :return:
         """
-        deps = self.config.get_build_up_to_deps(self.top, self.facts, self.debug)
+        deps = self.config.get_build_up_to_deps(self.top, self.facts, self.debug, self.jobs)
         for component in self.bu2_components:
             if not component:
                 continue
             if self.debug:
                 print("Before combining with %s dependency list is %s" % (component, json.dumps(deps, indent=3)))
             facts = self.config.gather_facts(component, self.branch, self.type, self.path)
-            component_deps = self.config.get_build_up_to_deps(component, facts, self.debug)
+            component_deps = self.config.get_build_up_to_deps(component, facts, self.debug, self.jobs)
             deps = self.config.combine_build_up_to_deps(deps, component_deps)
             if self.debug:
                 print("After combining with %s dependency list is %s" % (component, json.dumps(deps, indent=3)))
@@ -116,10 +151,21 @@ class Sandbox:
                                source=vcsrepo['source'],
                                revision=vcsrepo['revision'],
                                type_=self.facts['top_built_aspect']['type'])
+        if self.incremental:
+            checkout = self._update_publish_checkout()
+            rev = self.config.create_publish_files(self.facts['top']['name'], vcsrepo['path'], self.facts['aspects'],
+                                                   self.facts['build_type'], checkout.get_hidden_folder(), self.jobs,
+                                                   self.facts['config_commit'])
+            paths = sync_tree(vcsrepo['path'], checkout.path, skip=(vcs.get_hidden_folder(), '.gitignore', '.bzrignore'),
+                              jobs=self.jobs)
+            checkout.publish_paths(paths, "Published %s.%s.%s for %s" % (self.top, self.branch, rev,
+                                                                         self.facts['build_type']))
+            return
         if not vcs.exists():
             raise CommandError("There is no VCS repo at %s.  Run command 'publish_prep' first." % (vcsrepo['path']))
         rev = self.config.create_publish_files(self.facts['top']['name'], vcsrepo['path'], self.facts['aspects'],
-                                               self.facts['build_type'], vcs.get_hidden_folder())
+                                               self.facts['build_type'], vcs.get_hidden_folder(), self.jobs,
+                                               self.facts['config_commit'])
 
         vcs.publish("Published %s.%s.%s for %s" % (self.top, self.branch, rev, self.facts['build_type']))
 
@@ -133,50 +179,162 @@ class Sandbox:
         """
         Prints the status of all modified repositories.
         """
-        for aspect in self.facts['aspects']:
-            self.config.print_aspect_status(aspect)
+        self.print_report(self.scan_aspects(self.config.get_aspect_status, 'status'),
+                          Sandbox.format_status, Sandbox.format_status_porcelain)
 
     def missing(self):
         """
         Prints the commits that are missing in the local repositories.
         """
-        for aspect in self.facts['aspects']:
-            self.config.print_aspect_missing(aspect)
+        self.print_report(self.scan_aspects(self.config.get_aspect_missing, 'missing'),
+                          lambda r: "Missing for %s:\n\n%s" % (r['path'], r['missing']),
+                          lambda r: "%s\t%s\t%s" % (r['component'], r['type'], r['path']))
 
-    def _clone_or_update_aspects(self, force=False):
+    def scan_aspects(self, report, key):
+        """
+        Run report on every aspect at the same time. Returns the reports that found something, in aspect order.
         """
-        Clones aspect repositories if they doesn't exist or updates them if the do
+        return [r for r in run_in_parallel(report, self.facts['aspects'], self.jobs) if r[key]]
+
+    def print_report(self, reports, text, porcelain, output=None):
+        """
+        Print the reports of scan_aspects as text, as one tab separated line per repository or as json.
+        """
+        output = output or self.output
+        if output == 'json':
+            print(json.dumps(reports, indent=3))
+            return
+        for r in reports:
+            print(porcelain(r) if output == 'porcelain' else text(r))
+
+    @staticmethod
+    def format_status(report):
+        status = report['status']
+        lines = ["Status for %s:" % report['path']]
+        if status['branch']:
+            branch = "On branch %s" % status['branch']
+            if status['upstream']:
+                branch += ", %d ahead and %d behind %s" % (status['ahead'], status['behind'], status['upstream'])
+            lines.append(branch)
+        lines.extend(status['files'])
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def format_status_porcelain(report):
+        status = report['status']
+        return "%s\t%s\t%d\t%d\t%d\t%d\t%s" % (report['component'], report['type'], status['modified'],
+                                                status['untracked'], status['ahead'], status['behind'], report['path'])
+
+    def _clone_or_update_aspects(self, force=False, journal=None):
+        """
+        Clones aspect repositories if they doesn't exist or updates them if the do. With the journal of an init the
+        progress of every aspect is recorded and the journal is removed once the sandbox is complete.
         """
         try:
-            for aspect in self.facts['aspects']:
-                if aspect['type'] == 'built':
-                    if aspect['clone']:
-                        self.config.clone_or_update_aspect(aspect, force)
-                    continue
-                if aspect['type'] == 'code':
-                    os.makedirs(aspect['vcsrepo']['built_path'], exist_ok=True)
-                self.config.clone_or_update_aspect(aspect, force)
+            if journal:
+                journal.show_progress()
+            try:
+                run_in_parallel(lambda aspect: self._clone_or_update_aspect(aspect, force, journal),
+                                self.facts['aspects'], self.jobs)
+            finally:
+                if journal:
+                    journal.stop_progress()
             self.config.create_dependency_files(self.path, self.facts['top']['name'], self.facts['components'],
                                                 self.facts['build_type'])
+            self.write_facts(self.facts)
+            self.write_command_manifest()
             self.exe_command("tools")
             self.exe_command("init_config")
+            if journal:
+                journal.remove()
         except SandmanException as e:
             print("The following error occurred: %s\n" % e)
-            if prompt_question("Would you like to remove incomplete sandbox %s?" % self.name):
+            if journal:
+                print("%d of %d aspects of sandbox %s are done. Run init again to resume it or remove it to start over."
+                      % (journal.finished, journal.total, self.name))
+            elif prompt_question("Would you like to remove incomplete sandbox %s?" % self.name):
                 self.remove()
 
+    def _clone_or_update_aspect(self, aspect, force=False, journal=None):
+        """
+        Clones or updates a single aspect. Safe to call from several threads at once.
+        """
+        if not Sandbox.is_cloned(aspect) or journal and journal.is_done(aspect):
+            return
+        if aspect['type'] == 'code':
+            os.makedirs(aspect['vcsrepo']['built_path'], exist_ok=True)
+        if not journal:
+            self.config.clone_or_update_aspect(aspect, force)
+            return
+        reclone = journal.was_interrupted(aspect)
+        journal.start(aspect)
+        try:
+            vcs = self.config.clone_or_update_aspect(aspect, force, reclone)
+        except SandmanException as e:
+            journal.fail(aspect, e)
+            raise
+        journal.finish(aspect, vcs.get_head_revision())
+
+    @staticmethod
+    def is_cloned(aspect):
+        """
+        Whether an aspect has a checkout in the sandbox. Built aspects are only cloned when nothing is built locally.
+        """
+        return aspect['type'] != 'built' or aspect['clone']
+
     def get_commands(self):
         """
         Return the available commands that can be executed in this sandbox
         """
         return list(set([c['name'] for c in self.facts['commands']]))
 
+    def load_facts(self):
+        """
+        Reuse the facts saved in the sandbox when they were resolved from the same inputs, otherwise gather them
+        from the config again.
+        """
+        if self.facts_key:
+            cached = _facts.get(self.path)
+            if cached and cached['key'] == self.facts_key:
+                return cached['facts']
+            cached = read_json(os.path.join(self.path, FACTS_CACHE))
+            if cached and cached.get('key') == self.facts_key:
+                _facts[self.path] = cached
+                return cached['facts']
+        facts = self.config.gather_facts(self.top, self.branch, self.type, self.path)
+        self.write_facts(facts)
+        return facts
+
+    def write_facts(self, facts):
+        if not self.facts_key or facts['config_commit'] != self.facts_key['config_commit'] or \
+                not os.path.isdir(os.path.join(self.path, 'run')):
+            return
+        _facts[self.path] = {'key': self.facts_key, 'facts': facts}
+        write_json(os.path.join(self.path, FACTS_CACHE), _facts[self.path])
+
+    def write_command_manifest(self):
+        """
+        Save the available commands in the sandbox so sb2 can list them without loading the config
+        """
+        if not os.path.isdir(os.path.join(self.path, 'run')):
+            return
+        write_json(os.path.join(self.path, COMMAND_MANIFEST), {
+            'branch': self.branch,
+            'config_commit': self.facts['config_commit'],
+            'fetch_stamp': self.config.fetch_stamp,
+            'commands': sorted(self.get_commands()),
+        })
+
+    @staticmethod
+    def read_command_manifest(path):
+        return layout.read_command_manifest(path)
+
     def exe_command(self, name):
         """
         Execute one of the available commands in this sandbox
         """
         # I don't check if command exists because argparse checks before this is called
-        command = [a for a in self.facts['commands'] if a['name'] == name][0]
+        command = deepcopy([a for a in self.facts['commands'] if a['name'] == name][0])
         if command['type'] == 'command' and len(command['command']) > 0:
             if 'cwd' not in command:
                 if not os.path.isdir(self.path):
@@ -201,23 +359,8 @@ class Sandbox:
 
     @staticmethod
     def get_sandbox_from_path(path):
-        path = os.path.abspath(path)
-        segments = path.split('/')
-        i = len(segments) - 1
-        while i >= 0:
-            m = STANDARD_NAME_PAT.match(segments[i])
-            if m:
-                return '/'.join(segments[0:i]), segments[i]
-            i -= 1
-        return None, None
+        return layout.get_sandbox_from_path(path)
 
     @staticmethod
     def parse_sandbox_name(name):
-        """
-        Split a sandbox name into its 3 constituent pieces (component, branch, task).
-        Return a 3-tuple. Raises SandboxNameError if name is invalid.
-        """
-        m = STANDARD_NAME_PAT.match(name)
-        if not m:
-            raise SandboxNameError(name)
-        return m.group(1), m.group(2), m.group(3)
+        return layout.parse_sandbox_name(name)
@@ -0,0 +1,154 @@
+import atexit
+import functools
+import json
+import os
+import subprocess
+import threading
+import time
+
+# Set SANDMAN_TRACE to a file to get a Chrome trace (chrome://tracing, Perfetto) of the VCS commands and config
+# stages of a run. A %p in the path is replaced with the process id so concurrent runs don't overwrite each other.
+TRACE_PATH = os.environ.get('SANDMAN_TRACE')
+
+_events = []
+_events_lock = threading.Lock()
+_active = threading.local()
+
+
+def _now():
+    return time.time() * 1000000
+
+
+def record(name, category, start, args):
+    """
+    Add a complete event that began at start, in microseconds, and ends now.
+    """
+    event = {
+        'name': name,
+        'cat': category,
+        'ph': 'X',
+        'ts': start,
+        'dur': _now() - start,
+        'pid': os.getpid(),
+        'tid': threading.get_ident(),
+        'args': args,
+    }
+    with _events_lock:
+        _events.append(event)
+
+
+def write(path=None):
+    """
+    Write the events recorded so far as a Chrome trace.
+    """
+    path = (path or TRACE_PATH).replace('%p', str(os.getpid()))
+    with _events_lock:
+        events = list(_events)
+    try:
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+    except OSError:
+        pass
+
+
+def traced(name):
+    """
+    Decorate a function so every call is a span in the trace. Calls made while the same span is already open on
+    the thread, like recursion, are part of the outer span.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not TRACE_PATH or name in getattr(_active, 'spans', ()):
+                return func(*args, **kwargs)
+            if not hasattr(_active, 'spans'):
+                _active.spans = set()
+            _active.spans.add(name)
+            start = _now()
+            error = None
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                error = e.__class__.__name__
+                raise
+            finally:
+                _active.spans.discard(name)
+                record(name, 'config', start, {'error': error} if error else {})
+        return wrapper
+    return decorate
+
+
+class Popen(subprocess.Popen):
+    """
+    subprocess.Popen that records the command, the repository it runs in, its wall time, the bytes of output read
+    through communicate and its exit code once it finishes.
+    """
+    def __init__(self, args, *popen_args, **kwargs):
+        self.trace_start = _now()
+        self.trace_args = args
+        self.trace_cwd = kwargs.get('cwd')
+        self.trace_output = 0
+        self.trace_recorded = not TRACE_PATH
+        self.trace_communicating = False
+        super(Popen, self).__init__(args, *popen_args, **kwargs)
+
+    def communicate(self, input=None, timeout=None):
+        self.trace_communicating = True
+        try:
+            out, err = super(Popen, self).communicate(input, timeout)
+        finally:
+            self.trace_communicating = False
+        self.trace_output += len(out or b'') + len(err or b'')
+        self._record()
+        return out, err
+
+    def wait(self, timeout=None):
+        returncode = super(Popen, self).wait(timeout)
+        if not self.trace_communicating:
+            self._record()
+        return returncode
+
+    def _record(self):
+        if self.trace_recorded:
+            return
+        self.trace_recorded = True
+        args = self.trace_args if isinstance(self.trace_args, (list, tuple)) else [self.trace_args]
+        repo = self.trace_cwd
+        if '-C' in args[:-1]:
+            repo = args[args.index('-C') + 1]
+        elif '-d' in args[:-1]:
+            repo = args[args.index('-d') + 1]
+        name = ' '.join(str(a) for a in args[:2] if not str(a).startswith('-'))
+        if args[:1] == ['git']:
+            # The subcommand follows the global options, -C and -c take a value
+            i = 1
+            while i < len(args) and str(args[i]).startswith('-'):
+                i += 2 if args[i] in ('-C', '-c') else 1
+            if i < len(args):
+                name = 'git %s' % args[i]
+        record(name, 'vcs', self.trace_start, {
+            'command': ' '.join(str(a) for a in args),
+            'repo': repo or os.getcwd(),
+            'output_bytes': self.trace_output,
+            'exit_code': self.returncode,
+        })
+
+
+def check_call(args, **kwargs):
+    with Popen(args, **kwargs) as p:
+        returncode = p.wait()
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, args)
+    return 0
+
+
+def check_output(args, **kwargs):
+    with Popen(args, stdout=subprocess.PIPE, **kwargs) as p:
+        output = p.communicate()[0]
+    if p.returncode:
+        raise subprocess.CalledProcessError(p.returncode, args, output=output)
+    return output
+
+
+if TRACE_PATH:
+    atexit.register(write)
@@ -1,3 +1,8 @@
+from lib.exceptions import ParallelError
+from lib.exceptions import SandmanException
+
+DEFAULT_JOBS = 4
+
 
 def prompt_question(question):
     reply = str(input(question+' (y/n): ')).lower().strip()
@@ -9,3 +14,29 @@ def prompt_question(question):
         return False
     else:
         return prompt_question("Please enter y or n.")
+
+
+def run_in_parallel(func, items, jobs=1):
+    """
+    Calls func for every item using at most jobs worker threads and waits for all of them to finish.
+    Returns the results in the same order as items. SandmanExceptions raised by the calls are collected
+    and raised together as a ParallelError once every call is done.
+    """
+    items = list(items)
+    if not items:
+        return []
+    # Only imported once something runs in parallel, it is slow to import and the tools often don't need it
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(items)))) as executor:
+        futures = [executor.submit(func, item) for item in items]
+    results = []
+    errors = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except SandmanException as e:
+            errors.append(e)
+            results.append(None)
+    if errors:
+        raise ParallelError(errors)
+    return results
@@ -1,19 +1,36 @@
 import os
 
+# Build output that is never published
+PUBLISH_IGNORE = ['*.obj', '*.o', '*.pdb', '*.a', 'CMakeFiles']
+
 
 class Vcs:
-    def __init__(self, path, source, revision='master', type_='code'):
+    """
+    Base class of the version control backends. Implementations pass the repository path to every command
+    they run instead of changing the working directory, so operations on different repositories can run
+    in parallel threads.
+    """
+    def __init__(self, path, source, revision='master', type_='code', mirror=None, fetch=None):
         self.path = os.path.abspath(path)
         self.source = source
         self.revision = revision
         self.type = type_
+        self.mirror = mirror
+        self.fetch = fetch or {}
 
-    def checkout(self, branch):
+    def checkout(self, branch, fetch=True):
         raise NotImplementedError()
 
     def exists(self):
         raise NotImplementedError()
 
+    def is_complete(self):
+        """
+        Whether the repository exists and was checked out completely. A clone that was interrupted can leave a
+        repository behind that has no head yet.
+        """
+        return self.exists()
+
     def get_head_commit(self):
         raise NotImplementedError()
 
@@ -35,16 +52,36 @@ class Vcs:
     def publish_prep(self):
         raise NotImplementedError()
 
-    def print_missing(self):
+    def get_missing(self):
+        """
+        Return the log of the remote commits that are missing locally, or None when there are none.
+        """
         raise NotImplementedError()
 
-    def print_status(self):
+    def get_status(self, fast=False):
+        """
+        Return the status of a repository with local changes or unpushed commits, or None when it is clean.
+        The status is a dict with the branch, its upstream, the ahead, behind, modified and untracked counts
+        and the changed files. fast enables the untracked cache and fsmonitor where the backend has them.
+        """
         raise NotImplementedError()
 
     def publish(self, commit_message):
         raise NotImplementedError()
 
-    def branches(self):
+    def publish_paths(self, paths, commit_message):
+        """
+        Publish only the given paths, relative to the repository, which were added, changed or removed.
+        """
+        raise NotImplementedError()
+
+    def branches(self, fetch=True):
+        raise NotImplementedError()
+
+    def branch_revisions(self):
+        raise NotImplementedError()
+
+    def show_file(self, revision, file_path):
         raise NotImplementedError()
 
     def remove(self):
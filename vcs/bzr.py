@@ -1,59 +1,55 @@
-from vcs import Vcs
+from vcs import Vcs, PUBLISH_IGNORE
+from vcs.refcache import remote_refs
 import os
 import subprocess
 import shutil
-from subprocess import Popen
+from lib import trace
+from lib.trace import Popen
 
 
 class Bzr(Vcs):
 
-    def checkout(self, branch):
+    def checkout(self, branch, fetch=True):
         raise NotImplementedError
 
     def exists(self):
         return os.path.exists(os.path.join(self.path, '.bzr'))
 
     def get_head_commit(self):
-        cwd = os.getcwd()
-        rev = None
         if not os.path.isdir(self.path):
             return None
-        try:
-            os.chdir(self.path)
-            p = Popen(["bzr", "log", "--log-format=line", '-l', '1'], stdout=subprocess.PIPE)
-            stdout = p.communicate()[0].decode().replace('\n', ' ')
-            if stdout:
-                return stdout
-        finally:
-            os.chdir(cwd)
-        return rev
+        p = Popen(["bzr", "log", "--log-format=line", '-l', '1'], stdout=subprocess.PIPE, cwd=self.path)
+        stdout = p.communicate()[0].decode().replace('\n', ' ')
+        if stdout:
+            return stdout
+        return None
 
     def get_head_revision(self):
-        cwd = os.getcwd()
-        rev = None
         if not os.path.isdir(self.path):
             return None
-        try:
-            os.chdir(self.path)
-            p = Popen(["bzr", "version-info", "--custom", '--template=revno={revno},revision_id={revision_id}'], stdout=subprocess.PIPE)
-            stdout = p.communicate()[0].decode()
-            if stdout:
-                return stdout
-        finally:
-            os.chdir(cwd)
-        return rev
+        p = Popen(["bzr", "version-info", "--custom", '--template=revno={revno},revision_id={revision_id}'],
+                  stdout=subprocess.PIPE, cwd=self.path)
+        stdout = p.communicate()[0].decode()
+        if stdout:
+            return stdout
+        return None
 
     def get_remote_head_revision(self):
-        rev = None
-        p = Popen(["bzr", "revision-info", "-d", self.source], stdout=subprocess.PIPE,
+        return (remote_refs.get(self.source, Bzr.list_remote_refs) or {}).get('HEAD')
+
+    @staticmethod
+    def list_remote_refs(source):
+        p = Popen(["bzr", "revision-info", "-d", source], stdout=subprocess.PIPE,
                              stderr=subprocess.DEVNULL)
         stdout = p.communicate()[0].decode()
+        if p.returncode:
+            return None
         for l in stdout.split('\n'):
             data = l.split(' ')
             # If data[1] == 'null:' the repo exists but there are no commits
             if len(data) > 1 and data[1] != 'null:':
-                return data[1]
-        return rev
+                return {'HEAD': data[1]}
+        return {}
 
     def get_sources(self):
         p = Popen(["bzr", "cat", "%s/%s" % (self.source, 'source.txt')], stdout=subprocess.PIPE,
@@ -78,85 +74,85 @@ class Bzr(Vcs):
     def init(self):
         os.makedirs(self.path, exist_ok=True)
         if self.type == 'built':
-            subprocess.check_call(["bzr", "checkout", "--lightweight", self.source, self.path],
-                                  stdout=subprocess.DEVNULL)
+            trace.check_call(["bzr", "checkout", "--lightweight", self.source, self.path],
+                             stdout=subprocess.DEVNULL)
         else:
-            subprocess.check_call(["bzr", "branch", "--standalone", "--use-existing-dir", self.source, self.path],
-                                  stdout=subprocess.DEVNULL)
-        subprocess.check_call(["bzr", "config", "-d", self.path, "push_location=%s" % self.source],
-                              stdout=subprocess.DEVNULL)
-        subprocess.check_call(["bzr", "config", "-d", self.path, "submit_location=%s" % self.source],
-                              stdout=subprocess.DEVNULL)
+            trace.check_call(["bzr", "branch", "--standalone", "--use-existing-dir", self.source, self.path],
+                             stdout=subprocess.DEVNULL)
+        trace.check_call(["bzr", "config", "-d", self.path, "push_location=%s" % self.source],
+                         stdout=subprocess.DEVNULL)
+        trace.check_call(["bzr", "config", "-d", self.path, "submit_location=%s" % self.source],
+                         stdout=subprocess.DEVNULL)
 
     def update(self):
-        cwd = os.getcwd()
-        try:
-            os.chdir(self.path)
-            if self.type == 'built':
-                subprocess.check_call(["bzr", "update"], stdout=subprocess.DEVNULL)
-            else:
-                subprocess.check_call(["bzr", "pull", self.source], stdout=subprocess.DEVNULL)
-        finally:
-            os.chdir(cwd)
+        if self.type == 'built':
+            trace.check_call(["bzr", "update"], stdout=subprocess.DEVNULL, cwd=self.path)
+        else:
+            trace.check_call(["bzr", "pull", self.source], stdout=subprocess.DEVNULL, cwd=self.path)
 
     def force_update(self):
-        cwd = os.getcwd()
-        try:
-            os.chdir(self.path)
-            subprocess.check_call(["bzr", "revert"], stdout=subprocess.DEVNULL)
-            subprocess.check_call(["bzr", "pull", self.source], stdout=subprocess.DEVNULL)
-        finally:
-            os.chdir(cwd)
+        trace.check_call(["bzr", "revert"], stdout=subprocess.DEVNULL, cwd=self.path)
+        trace.check_call(["bzr", "pull", self.source], stdout=subprocess.DEVNULL, cwd=self.path)
 
     def publish_prep(self):
-        cwd = os.getcwd()
-        try:
-            os.chdir(self.path)
-            for path in os.listdir(self.path):
-                if path == '.bzr':
-                    continue
-                if os.path.isdir(path):
-                    shutil.rmtree(path)
-                else:
-                    os.remove(path)
-        finally:
-            os.chdir(cwd)
-
-    def print_missing(self):
-        cwd = os.getcwd()
-        try:
-            os.chdir(self.path)
-            p = Popen(["bzr", "missing"], stdout=subprocess.PIPE)
-            out = p.communicate()[0].decode()
-            if 'up to date' not in out:
-                print("Missing for %s:" % self.path)
-                print(out)
-        finally:
-            os.chdir(cwd)
-
-    def print_status(self):
-        p = Popen(["bzr", "status", self.path], stdout=subprocess.PIPE)
+        for path in os.listdir(self.path):
+            if path == '.bzr':
+                continue
+            path = os.path.join(self.path, path)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
+    def get_missing(self):
+        p = Popen(["bzr", "missing"], stdout=subprocess.PIPE, cwd=self.path)
         out = p.communicate()[0].decode()
-        if out:
-            print("Status for %s:" % self.path)
-            print(out)
-            return True
-        return False
+        if 'up to date' not in out:
+            return out
+        return None
+
+    def get_status(self, fast=False):
+        p = Popen(["bzr", "status", "--short", self.path], stdout=subprocess.PIPE)
+        out = p.communicate()[0].decode()
+        status = {'branch': None, 'upstream': None, 'ahead': 0, 'behind': 0, 'modified': 0, 'untracked': 0,
+                  'files': []}
+        for line in out.split('\n'):
+            if not line.strip():
+                continue
+            if line.startswith('?'):
+                status['untracked'] += 1
+            else:
+                status['modified'] += 1
+            status['files'].append(line)
+        if status['files']:
+            return status
+        return None
+
+    def write_ignore_file(self):
+        with open(os.path.join(self.path, '.bzrignore'), 'w') as ignore_file:
+            ignore_file.writelines("%s\n" % pattern for pattern in PUBLISH_IGNORE)
 
     def publish(self, commit_message):
-        cwd = os.getcwd()
-        try:
-            os.chdir(self.path)
-            ignore_file = open('.bzrignore', 'w')
-            ignore_type = ['*.obj\n', '*.o\n', '*.pdb\n', '*.a\n', 'CMakeFiles\n']
-            ignore_file.writelines(ignore_type)
-            ignore_file.close()
-
-            subprocess.check_call(["bzr", "add", "."], stdout=subprocess.DEVNULL)
-            subprocess.check_call(["bzr", "commit", "-m", commit_message], stdout=subprocess.DEVNULL)
-            subprocess.check_call(["bzr", "push", self.source], stdout=subprocess.DEVNULL)
-        finally:
-            os.chdir(cwd)
-
-    def branches(self):
+        self.write_ignore_file()
+        trace.check_call(["bzr", "add", "."], stdout=subprocess.DEVNULL, cwd=self.path)
+        trace.check_call(["bzr", "commit", "-m", commit_message], stdout=subprocess.DEVNULL, cwd=self.path)
+        trace.check_call(["bzr", "push", self.source], stdout=subprocess.DEVNULL, cwd=self.path)
+
+    def publish_paths(self, paths, commit_message):
+        self.write_ignore_file()
+        # Removed files are picked up by commit, only new files have to be added
+        added = ['.bzrignore'] + [p for p in paths if os.path.lexists(os.path.join(self.path, p))]
+        for i in range(0, len(added), 1000):
+            trace.check_call(["bzr", "add", "--no-recurse"] + added[i:i + 1000], stdout=subprocess.DEVNULL,
+                             cwd=self.path)
+        trace.check_call(["bzr", "commit", "-m", commit_message], stdout=subprocess.DEVNULL, cwd=self.path)
+        trace.check_call(["bzr", "push", self.source], stdout=subprocess.DEVNULL, cwd=self.path)
+
+    def branches(self, fetch=True):
+        raise NotImplementedError
+
+    def branch_revisions(self):
+        raise NotImplementedError
+
+    def show_file(self, revision, file_path):
         raise NotImplementedError
@@ -1,55 +1,56 @@
-from vcs import Vcs
+from vcs import Vcs, PUBLISH_IGNORE
+from vcs.refcache import remote_refs, lookup_ref
 import os
 import subprocess
 import shutil
 from lib.exceptions import VcsError
-from subprocess import Popen
+from lib import trace
+from lib.trace import Popen
 
 
 class Git(Vcs):
-    def checkout(self, branch):
-        cwd = os.getcwd()
-        try:
-            os.chdir(self.path)
-            subprocess.check_call(["git", "reset", "--hard", "--quiet"], stdout=subprocess.DEVNULL)
-            subprocess.check_call(["git", "fetch", "--quiet"], stdout=subprocess.DEVNULL)
-            subprocess.check_call(["git", "checkout", "--quiet", branch], stdout=subprocess.DEVNULL)
-            self.revision = branch
-        finally:
-            os.chdir(cwd)
+    def _git(self, *args):
+        """
+        Build a git command line that runs against this repository without changing the working directory.
+        """
+        return ["git", "-C", self.path] + list(args)
+
+    def checkout(self, branch, fetch=True):
+        trace.check_call(self._git("reset", "--hard", "--quiet"), stdout=subprocess.DEVNULL)
+        if fetch:
+            trace.check_call(self._git("fetch", "--quiet"), stdout=subprocess.DEVNULL)
+        trace.check_call(self._git("checkout", "--quiet", "-B", branch, "origin/%s" % branch),
+                         stdout=subprocess.DEVNULL)
+        self.revision = branch
 
     def exists(self):
-        cwd = os.getcwd()
-        try:
-            exists = os.path.exists(os.path.join(self.path, '.git'))
-            if exists:
-                os.chdir(self.path)
-                p = Popen(["git", "config", "--get", "remote.origin.url"], stdout=subprocess.PIPE)
-                out = p.communicate()[0].decode()
-                if self.source not in out:
-                    subprocess.check_call(["git", "config", "remote.origin.url", self.source], stdout=subprocess.DEVNULL)
-        finally:
-            os.chdir(cwd)
+        exists = os.path.exists(os.path.join(self.path, '.git'))
+        if exists:
+            p = Popen(self._git("config", "--get", "remote.origin.url"), stdout=subprocess.PIPE)
+            out = p.communicate()[0].decode()
+            if self.source not in out:
+                trace.check_call(self._git("config", "remote.origin.url", self.source), stdout=subprocess.DEVNULL)
         return exists
 
+    def is_complete(self):
+        if not os.path.exists(os.path.join(self.path, '.git')):
+            return False
+        p = Popen(self._git("rev-parse", "--verify", "--quiet", "HEAD^{commit}"), stdout=subprocess.DEVNULL,
+                  stderr=subprocess.DEVNULL)
+        return p.wait() == 0 and self.exists()
+
     def get_head_commit(self):
-        cwd = os.getcwd()
-        rev = None
         if not os.path.isdir(self.path):
             return None
-        try:
-            os.chdir(self.path)
-            p = Popen(["git", "log", '-1', "--format=%h: %an %ad %s", "--date=short"], stdout=subprocess.PIPE)
-            stdout = p.communicate()[0].decode().replace('\n', ' ')
-            if stdout:
-                return stdout
-        finally:
-            os.chdir(cwd)
-        return rev
+        p = Popen(self._git("log", '-1', "--format=%h: %an %ad %s", "--date=short"), stdout=subprocess.PIPE)
+        stdout = p.communicate()[0].decode().replace('\n', ' ')
+        if stdout:
+            return stdout
+        return None
 
     def get_sources(self):
         p = Popen(["git", "archive", "--remote=%s" % self.source, self.revision, 'source.txt'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
-        output = subprocess.check_output(('tar', '-xOf', '-'), stdin=p.stdout)
+        output = trace.check_output(('tar', '-xOf', '-'), stdin=p.stdout)
         p.wait()
         stdout = output.decode()
         sources = []
@@ -66,130 +67,219 @@ class Git(Vcs):
         return sources
 
     def get_head_revision(self):
-        cwd = os.getcwd()
-        rev = None
-        try:
-            os.chdir(self.path)
-            p = Popen(["git", "rev-parse", "HEAD"], stdout=subprocess.PIPE)
-            rev = p.communicate()[0].decode().replace('\n', '')
-        finally:
-            os.chdir(cwd)
-        return rev
+        p = Popen(self._git("rev-parse", "HEAD"), stdout=subprocess.PIPE)
+        return p.communicate()[0].decode().replace('\n', '')
 
     def get_remote_head_revision(self):
-        rev = None
-        p = Popen(["git", "ls-remote", self.source], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        return lookup_ref(remote_refs.get(self.source, Git.list_remote_refs), self.revision)
+
+    @staticmethod
+    def list_remote_refs(source):
+        refs = {}
+        p = Popen(["git", "ls-remote", source], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
         out = p.communicate()[0].decode()
+        if p.returncode:
+            return None
         for line in out.split('\n'):
-            if self.revision in line:
-                return line.split('\t')[0]
-        return rev
+            if '\t' not in line:
+                continue
+            commit, ref = line.split('\t', 1)
+            refs[ref] = commit
+        return refs
 
     def get_hidden_folder(self):
         return '.git'
 
+    def branch_revisions(self):
+        revisions = {}
+        p = Popen(self._git("for-each-ref", "--format=%(objectname) %(refname)", "refs/remotes/origin"),
+                  stdout=subprocess.PIPE)
+        out = p.communicate()[0].decode()
+        for line in out.split('\n'):
+            if ' ' not in line:
+                continue
+            commit, ref = line.split(' ', 1)
+            branch = ref.replace('refs/remotes/origin/', '', 1)
+            if branch != 'HEAD':
+                revisions[branch] = commit
+        return revisions
+
+    def show_file(self, revision, file_path):
+        p = Popen(self._git("show", "%s:%s" % (revision, file_path)), stdout=subprocess.PIPE,
+                  stderr=subprocess.DEVNULL)
+        out = p.communicate()[0]
+        if p.returncode:
+            return None
+        return out.decode()
+
     def init(self):
         try:
             os.makedirs(self.path, exist_ok=True)
         except PermissionError as e:
             raise VcsError(e, self.path, self.source, self.revision)
-        if self.type == 'built':
-            subprocess.check_call(["git", "clone", "--depth", "1", "--quiet", "-b", self.revision, self.source, self.path], stdout=subprocess.DEVNULL)
-        else:
-            subprocess.check_call(["git", "clone", "--quiet", "-b", self.revision, self.source, self.path], stdout=subprocess.DEVNULL)
+        cmd = ["git", "clone", "--quiet", "-b", self.revision]
+        if self.fetch.get('depth'):
+            cmd += ["--depth", str(self.fetch['depth'])]
+        if self.fetch.get('filter'):
+            cmd += ["--filter=%s" % self.fetch['filter']]
+        if self.fetch.get('sparse'):
+            cmd += ["--sparse"]
+        reference = self._mirror_path()[0]
+        if reference:
+            # A mirror that couldn't be refreshed still lends its objects, the rest comes from the source
+            cmd += ["--reference", reference]
+        trace.check_call(cmd + [self.source, self.path], stdout=subprocess.DEVNULL)
+        if self.fetch.get('sparse'):
+            trace.check_call(self._git("sparse-checkout", "set", *self.fetch['sparse']), stdout=subprocess.DEVNULL)
+
+    def _mirror_path(self):
+        """
+        The shared mirror of this repository, refreshed once per process, and whether it was refreshed. Shallow
+        clones never use a mirror.
+        """
+        if self.mirror is None or self.type == 'built' or self.fetch.get('depth'):
+            return None, False
+        return self.mirror.sync(self.source)
+
+    def _fetch_shallow(self):
+        """
+        Fetch the branch with the configured depth, so the history kept locally doesn't grow with every update.
+        """
+        trace.check_call(self._git("fetch", "--quiet", "--depth", str(self.fetch['depth']), "origin",
+                                   "+refs/heads/%s:refs/remotes/origin/%s" % (self.revision, self.revision)),
+                         stdout=subprocess.DEVNULL)
+
+    def _prune_shallow(self, previous_head):
+        """
+        Drop the objects that fell behind the depth once the branch moved.
+        """
+        if self.get_head_revision() == previous_head:
+            return
+        trace.check_call(self._git("reflog", "expire", "--expire=now", "--all"), stdout=subprocess.DEVNULL)
+        trace.check_call(self._git("gc", "--quiet", "--prune=now"), stdout=subprocess.DEVNULL)
 
     def update(self):
-        cwd = os.getcwd()
-        try:
-            os.chdir(self.path)
-            subprocess.check_call(["git", "pull", "--quiet"], stdout=subprocess.DEVNULL)
-        finally:
-            os.chdir(cwd)
+        reference, refreshed = self._mirror_path()
+        if reference and refreshed:
+            # The mirror was just refreshed so everything new comes from the local disk
+            trace.check_call(self._git("fetch", "--quiet", reference, "+refs/heads/*:refs/remotes/origin/*"),
+                             stdout=subprocess.DEVNULL)
+            # Like pull, the checked out branch follows its own upstream and fails when it has none
+            trace.check_call(self._git("merge", "--quiet", "--no-edit", "@{upstream}"), stdout=subprocess.DEVNULL)
+        elif self.fetch.get('depth'):
+            previous_head = self.get_head_revision()
+            self._fetch_shallow()
+            # Shallow histories have no common ancestor to merge on, local changes are kept where possible
+            trace.check_call(self._git("reset", "--quiet", "--keep", "origin/%s" % self.revision),
+                             stdout=subprocess.DEVNULL)
+            self._prune_shallow(previous_head)
+        else:
+            # Without a fresh mirror the new commits come from the source, objects the clone borrows from a stale
+            # mirror still aren't downloaded again
+            trace.check_call(self._git("pull", "--quiet"), stdout=subprocess.DEVNULL)
 
     def force_update(self):
-        cwd = os.getcwd()
-        try:
-            os.chdir(self.path)
-            subprocess.check_call(["git", "reset", "--hard", "--quiet"], stdout=subprocess.DEVNULL)
-            subprocess.check_call(["git", "pull", "--quiet"], stdout=subprocess.DEVNULL)
-        finally:
-            os.chdir(cwd)
+        trace.check_call(self._git("reset", "--hard", "--quiet"), stdout=subprocess.DEVNULL)
+        if self.fetch.get('depth') and not self._mirror_path()[0]:
+            previous_head = self.get_head_revision()
+            self._fetch_shallow()
+            trace.check_call(self._git("reset", "--hard", "--quiet", "origin/%s" % self.revision),
+                             stdout=subprocess.DEVNULL)
+            self._prune_shallow(previous_head)
+            return
+        self.update()
 
     def publish_prep(self):
-        cwd = os.getcwd()
-        try:
-            os.chdir(self.path)
-            for path in os.listdir(self.path):
-                if path == '.git':
-                    continue
-                if os.path.isdir(path):
-                    shutil.rmtree(path)
-                else:
-                    os.remove(path)
-        finally:
-            os.chdir(cwd)
-
-    def print_missing(self):
-        cwd = os.getcwd()
-        try:
-            os.chdir(self.path)
-            subprocess.check_call(["git", "fetch", "--quiet"], stdout=subprocess.DEVNULL)
-            p = Popen(["git", "log", "HEAD..origin/%s" % self.revision], stdout=subprocess.PIPE)
-            out = p.communicate()[0].decode()
-            if out:
-                print("Missing for %s:\n" % self.path)
-                print(out)
-        finally:
-            os.chdir(cwd)
-
-    def print_status(self):
-        cwd = os.getcwd()
-        try:
-            os.chdir(self.path)
-            p = Popen(["git", "status"], stdout=subprocess.PIPE)
-            out = p.communicate()[0].decode()
-            if 'working directory clean' not in out:
-                print("Status for %s:\n" % self.path)
-                print(out)
-                return True
-        finally:
-            os.chdir(cwd)
-        return False
+        for path in os.listdir(self.path):
+            if path == '.git':
+                continue
+            path = os.path.join(self.path, path)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
+    def get_missing(self):
+        trace.check_call(self._git("fetch", "--quiet"), stdout=subprocess.DEVNULL)
+        p = Popen(self._git("log", "HEAD..origin/%s" % self.revision), stdout=subprocess.PIPE)
+        out = p.communicate()[0].decode()
+        if out:
+            return out
+        return None
+
+    def get_status(self, fast=False):
+        options = []
+        if fast:
+            options = ["-c", "core.untrackedCache=true", "-c", "core.fsmonitor=true"]
+        out = trace.check_output(self._git(*(options + ["status", "--porcelain=v2", "-z", "--branch"])))
+        status = Git.parse_status(out.decode())
+        if status['modified'] or status['untracked'] or status['ahead']:
+            return status
+        return None
+
+    @staticmethod
+    def parse_status(out):
+        """
+        Parse the output of git status --porcelain=v2 -z --branch.
+        """
+        status = {'branch': None, 'upstream': None, 'ahead': 0, 'behind': 0, 'modified': 0, 'untracked': 0,
+                  'files': []}
+        entries = iter(out.split('\0'))
+        for entry in entries:
+            if entry.startswith('# branch.head '):
+                status['branch'] = entry[len('# branch.head '):]
+            elif entry.startswith('# branch.upstream '):
+                status['upstream'] = entry[len('# branch.upstream '):]
+            elif entry.startswith('# branch.ab '):
+                ahead, behind = entry[len('# branch.ab '):].split(' ')
+                status['ahead'] = int(ahead)
+                status['behind'] = -int(behind)
+            elif entry.startswith('? '):
+                status['untracked'] += 1
+                status['files'].append("?? %s" % entry[2:])
+            elif entry[:2] in ('1 ', '2 ', 'u '):
+                fields = {'1': 8, '2': 9, 'u': 10}[entry[0]]
+                status['modified'] += 1
+                status['files'].append("%s %s" % (entry[2:4], entry.split(' ', fields)[fields]))
+                if entry[0] == '2':
+                    # Renames are followed by the original path
+                    next(entries, None)
+        return status
+
+    def write_ignore_file(self):
+        with open(os.path.join(self.path, '.gitignore'), 'w') as ignore_file:
+            ignore_file.writelines("%s\n" % pattern for pattern in PUBLISH_IGNORE)
 
     def publish(self, commit_message):
-        cwd = os.getcwd()
-        try:
-            os.chdir(self.path)
-            ignore_file = open('.gitignore', 'w')
-            ignore_type = ['*.obj\n', '*.o\n', '*.pdb\n', '*.a\n', 'CMakeFiles\n']
-            ignore_file.writelines(ignore_type)
-            ignore_file.close()
-
-            subprocess.check_call(["git", "add", "--all"], stdout=subprocess.DEVNULL)
-            subprocess.check_call(["git", "commit", "-a", "--message", commit_message], stdout=subprocess.DEVNULL)
-            subprocess.check_call(["git", "push", "origin", self.revision], stdout=subprocess.DEVNULL)
-        finally:
-            os.chdir(cwd)
-
-    def branches(self):
+        self.write_ignore_file()
+        trace.check_call(self._git("add", "--all"), stdout=subprocess.DEVNULL)
+        trace.check_call(self._git("commit", "-a", "--message", commit_message), stdout=subprocess.DEVNULL)
+        trace.check_call(self._git("push", "origin", self.revision), stdout=subprocess.DEVNULL)
+
+    def publish_paths(self, paths, commit_message):
+        self.write_ignore_file()
+        # update-index only hashes the listed paths instead of scanning the whole tree like add --all
+        cmd = self._git("update-index", "--add", "--remove", "-z", "--stdin")
+        p = Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL)
+        p.communicate('\0'.join(['.gitignore'] + list(paths)).encode())
+        if p.returncode:
+            raise subprocess.CalledProcessError(p.returncode, cmd)
+        trace.check_call(self._git("commit", "--message", commit_message), stdout=subprocess.DEVNULL)
+        trace.check_call(self._git("push", "origin", self.revision), stdout=subprocess.DEVNULL)
+
+    def branches(self, fetch=True):
         branches = []
-        cwd = os.getcwd()
-        try:
-            os.chdir(self.path)
-            subprocess.check_call(["git", "reset", "--hard", "--quiet"], stdout=subprocess.DEVNULL)
-            subprocess.check_call(["git", "fetch", "--quiet"], stdout=subprocess.DEVNULL)
-            p = Popen(["git", "branch", "-r"], stdout=subprocess.PIPE)
-            out, err = p.communicate()
-            out = out.decode("utf-8").replace('\r', '')
-
-            for branch in out.split('\n'):
-                branch = branch.strip()
-                if '->' in branch:
-                    continue
-                if branch.startswith('origin/'):
-                    branches.append(branch.replace('origin/', ''))
-
-        finally:
-            os.chdir(cwd)
-        return branches
+        if fetch:
+            trace.check_call(self._git("reset", "--hard", "--quiet"), stdout=subprocess.DEVNULL)
+            trace.check_call(self._git("fetch", "--quiet"), stdout=subprocess.DEVNULL)
+        p = Popen(self._git("branch", "-r"), stdout=subprocess.PIPE)
+        out, err = p.communicate()
+        out = out.decode("utf-8").replace('\r', '')
 
+        for branch in out.split('\n'):
+            branch = branch.strip()
+            if '->' in branch:
+                continue
+            if branch.startswith('origin/'):
+                branches.append(branch.replace('origin/', ''))
+        return branches
@@ -0,0 +1,78 @@
+import fcntl
+import hashlib
+import os
+import shutil
+import subprocess
+import threading
+from subprocess import CalledProcessError
+from lib import trace
+
+
+class MirrorCache(object):
+    """
+    Bare mirrors of remote git repositories shared by every sandbox on the host. Sandboxes clone with
+    --reference so they borrow objects from the mirror instead of downloading them again. Mirrors are never
+    garbage collected or pruned because the sandboxes that borrow from them rely on every object staying put.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+        self.locks = {}
+        self.synced = {}
+
+    def path_for(self, source):
+        return os.path.join(self.root, "%s.git" % hashlib.sha1(source.encode()).hexdigest())
+
+    def _source_lock(self, source):
+        with self.lock:
+            return self.locks.setdefault(source, threading.Lock())
+
+    def sync(self, source):
+        """
+        Create or refresh the mirror of source, at most once per process. Returns the mirror path, or None
+        when there is no usable mirror, and whether it was refreshed. A mirror that couldn't be refreshed is
+        still returned so it can lend the objects it has, but it may be missing the latest commits.
+        """
+        with self._source_lock(source):
+            if source not in self.synced:
+                self.synced[source] = self._sync(source)
+            return self.synced[source]
+
+    def _sync(self, source):
+        path = self.path_for(source)
+        refreshed = False
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            with open("%s.lock" % path, 'a') as lock_file:
+                # Other sandman processes may be syncing the same mirror
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                if os.path.isdir(path):
+                    trace.check_call(["git", "-C", path, "fetch", "--quiet"], stdout=subprocess.DEVNULL,
+                                     stderr=subprocess.DEVNULL)
+                else:
+                    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+                    shutil.rmtree(tmp_path, ignore_errors=True)
+                    trace.check_call(["git", "clone", "--mirror", "--quiet", "--config", "gc.auto=0",
+                                      "--config", "core.sharedRepository=all", source, tmp_path],
+                                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                    os.rename(tmp_path, path)
+                refreshed = True
+        except (OSError, CalledProcessError):
+            shutil.rmtree("%s.%d.tmp" % (path, os.getpid()), ignore_errors=True)
+        if os.path.isdir(path):
+            return path, refreshed
+        return None, False
+
+
+_mirror_caches = {}
+_mirror_caches_lock = threading.Lock()
+
+
+def get_mirror_cache(root):
+    """
+    Return the process wide mirror cache for root, so every sandbox in the process shares one set of syncs.
+    """
+    with _mirror_caches_lock:
+        if root not in _mirror_caches:
+            _mirror_caches[root] = MirrorCache(root)
+        return _mirror_caches[root]
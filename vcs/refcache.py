@@ -0,0 +1,113 @@
+import re
+import threading
+import time
+
+# Revisions that are matched against the start of the advertised commits, shorter ones would match at random
+COMMIT_PREFIX = re.compile(r'^[0-9a-f]{7,40}$')
+
+
+class RemoteRefCache(object):
+    """
+    Process wide cache of what remotes advertise. Every remote is listed once; lookups made while a listing
+    is in flight wait for it instead of starting their own. Listings that fail aren't kept, so the next lookup
+    lists the remote again, but the remote is remembered as failed until it is listed.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.refs = {}
+        self.pending = {}
+        self.listers = {}
+        self.failed = set()
+        self.requested = {}
+
+    def get(self, source, list_refs):
+        """
+        Return the refs advertised by source, calling list_refs(source) only if nobody has listed it yet.
+        list_refs returns None when the remote can't be listed, then None is returned.
+        """
+        with self.lock:
+            self.requested[source] = time.monotonic()
+            if source in self.refs:
+                return self.refs[source]
+            event = self.pending.get(source)
+            owner = event is None
+            if owner:
+                event = self.pending[source] = threading.Event()
+                self.listers[source] = list_refs
+        if not owner:
+            event.wait()
+            with self.lock:
+                return self.refs.get(source)
+        refs = None
+        try:
+            refs = list_refs(source)
+        finally:
+            with self.lock:
+                if refs is not None:
+                    self.refs[source] = refs
+                    self.failed.discard(source)
+                else:
+                    self.failed.add(source)
+                del self.pending[source]
+            event.set()
+        return refs
+
+    def clear(self):
+        with self.lock:
+            self.refs = {}
+            self.listers = {}
+            self.failed = set()
+            self.requested = {}
+
+    def has_failed(self, source):
+        """
+        Whether the last listing of source failed.
+        """
+        with self.lock:
+            return source in self.failed
+
+    def refresh(self, jobs=1, max_age=None):
+        """
+        List every remote that was listed before again and swap the new refs in, so a long running process keeps
+        serving current refs without making lookups wait. Remotes that can't be listed keep their old refs.
+        Remotes that nobody asked for in the last max_age seconds are forgotten instead.
+        """
+        with self.lock:
+            if max_age is not None:
+                now = time.monotonic()
+                for source in [s for s, t in self.requested.items() if now - t > max_age]:
+                    for cache in (self.refs, self.listers, self.requested):
+                        cache.pop(source, None)
+                    self.failed.discard(source)
+            listers = dict(self.listers)
+        sources = list(listers)
+        # Imported here like in run_in_parallel, most processes never refresh
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            listed = list(executor.map(lambda source: listers[source](source), sources))
+        for source, refs in zip(sources, listed):
+            if refs is not None:
+                with self.lock:
+                    if source in self.listers:
+                        self.refs[source] = refs
+                        self.failed.discard(source)
+
+
+remote_refs = RemoteRefCache()
+
+
+def lookup_ref(refs, revision):
+    """
+    Resolve a branch, tag or commit prefix against the refs of a remote. Annotated tags resolve to the commit
+    they point to. Only revisions of at least 7 hex digits are matched as a commit prefix.
+    """
+    if refs is None:
+        return None
+    for ref in ('refs/heads/%s' % revision, 'refs/tags/%s^{}' % revision, 'refs/tags/%s' % revision, revision):
+        if ref in refs:
+            return refs[ref]
+    if COMMIT_PREFIX.match(revision):
+        for commit in refs.values():
+            if commit.startswith(revision):
+                return commit
+    return None
@@ -5,9 +5,9 @@ from vcs.bzr import Bzr
 class VcsRepo:
 
     @staticmethod
-    def get_repo(path, provider, source, revision='master', type_='code'):
+    def get_repo(path, provider, source, revision='master', type_='code', mirror=None, fetch=None):
         if provider == 'git':
-            return Git(path, source, revision, type_)
+            return Git(path, source, revision, type_, mirror, fetch)
         elif provider == 'bzr':
             return Bzr(path, source, revision, type_)
         else: